@@ -0,0 +1,187 @@
+from collections import namedtuple
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from multiprocessing import cpu_count, set_executable
+from os import getpid, path
+from shutil import rmtree
+from sys import exec_prefix, executable, exit
+from tempfile import mkdtemp
+from time import ctime, time
+
+from arcpy import CheckExtension, CheckInExtension, CheckOutExtension, Exists, GetParameterAsText, SetProgressorLabel
+from arcpy.da import InsertCursor, SearchCursor
+from arcpy.management import AddField, CreateFileGDB, CreateTable, Delete
+
+from hel_utils import AddMsgAndPrint, errorMsg
+from NRCS_HEL_Determination import base_dir, runHELDetermination, scratch_gdb, support_gdb
+
+
+# Fields of the per-tract summary table: (name, type, length)
+SUMMARY_FIELDS = [
+    ('Project', 'TEXT', 255),
+    ('Tract_Number', 'TEXT', 20),
+    ('Farm_Number', 'TEXT', 20),
+    ('Status', 'TEXT', 20),
+    ('CLU_Count', 'LONG', None),
+    ('HEL_CLU_Count', 'LONG', None),
+    ('Total_Acres', 'DOUBLE', None),
+    ('HEL_Acres', 'DOUBLE', None),
+    ('Seconds', 'DOUBLE', None),
+    ('Date_Run', 'TEXT', 30)
+]
+
+# Everything a worker process needs to run the determination for one tract; plain strings and flags so it pickles
+TractJob = namedtuple('TractJob', ['projectName', 'cluLayer', 'helLayer', 'inputDEM', 'zUnits', 'useRunoffLS'])
+
+# Scratch workspace of the current process; each pool worker replaces it with its own geodatabase
+workerScratchGDB = scratch_gdb
+
+
+def getTractJob(source, zUnits, useRunoffLS, helLayer='', inputDEM=''):
+    ''' Resolve a project folder or Site_Prepare_HELC feature class to a TractJob. The project Merged_HEL_Soil and
+        Site_DEM are used unless a soil layer or DEM is given for the whole batch.'''
+    source = source.strip().strip("'")
+    if path.isdir(source) and not source.lower().endswith('.gdb'):
+        projectFolder = source
+        projectName = path.basename(projectFolder)
+        cluLayer = path.join(projectFolder, 'HEL', f"{projectName}_HELC.gdb", 'HELC_Data', 'Site_Prepare_HELC')
+    else:
+        # ...\<project>\HEL\<project>_HELC.gdb\HELC_Data\Site_Prepare_HELC
+        cluLayer = source
+        projectFolder = path.dirname(path.dirname(path.dirname(path.dirname(cluLayer))))
+        projectName = path.basename(projectFolder)
+
+    basedataGDB_path = path.join(projectFolder, projectName.replace(' ', '_') + '_BaseData.gdb')
+    if not helLayer:
+        helLayer = path.join(basedataGDB_path, 'Layers', 'Merged_HEL_Soil')
+    if not inputDEM:
+        inputDEM = path.join(basedataGDB_path, 'Site_DEM')
+    return TractJob(projectName, cluLayer, helLayer, inputDEM, zUnits, useRunoffLS)
+
+
+def summarizeTract(cluLayer):
+    ''' Summarize the Field_Determination output of a tract: (tract, farm, CLUs, HEL CLUs, total acres, HEL acres).'''
+    fieldDetermination = path.join(path.dirname(cluLayer), 'Field_Determination')
+    tract = farm = None
+    cluCount = helCount = 0
+    totalAcres = helAcres = 0.0
+    fields = ['tract_number', 'farm_number', 'HEL_YES', 'HEL_Acres', 'clu_calculated_acres']
+    with SearchCursor(fieldDetermination, fields) as cursor:
+        for row in cursor:
+            tract, farm = row[0], row[1]
+            cluCount += 1
+            if row[2] == 'HEL':
+                helCount += 1
+            helAcres += row[3] or 0.0
+            totalAcres += row[4] or 0.0
+    return tract, farm, cluCount, helCount, totalAcres, helAcres
+
+
+def runTractJob(job):
+    ''' Run the determination for one TractJob in the current process. Returns its summary table row.'''
+    start = time()
+    tract, farm, cluCount, helCount, totalAcres, helAcres = None, None, 0, 0, 0.0, 0.0
+    if not Exists(job.cluLayer) or not Exists(job.helLayer):
+        AddMsgAndPrint(f"\tMissing Site_Prepare_HELC or HEL soil layer for {job.projectName}. Skipping...", 1)
+        status = 'Missing Inputs'
+    elif runHELDetermination(job.cluLayer, job.helLayer, job.inputDEM if Exists(job.inputDEM) else '', job.zUnits,
+                             job.useRunoffLS, workerScratchGDB):
+        tract, farm, cluCount, helCount, totalAcres, helAcres = summarizeTract(job.cluLayer)
+        status = 'Complete'
+    else:
+        status = 'Failed'
+    return [job.projectName, tract, farm, status, cluCount, helCount, totalAcres, helAcres, time() - start, ctime()]
+
+
+def initWorker(scratchFolder):
+    ''' Process pool initializer: give the worker its own scratch geodatabase and Spatial Analyst checkout.'''
+    global workerScratchGDB
+    workerScratchGDB = path.join(scratchFolder, f"scratch_{str(getpid())}.gdb")
+    CreateFileGDB(scratchFolder, path.basename(workerScratchGDB))
+    CheckOutExtension('Spatial')
+
+
+def runTractJobs(jobs, workers):
+    ''' Run TractJobs in a pool of worker processes, each with its own scratch workspace. Returns the summary rows in
+        job order.'''
+    # Inside ArcGIS Pro the interpreter is ArcGISPro.exe; workers must be started with the Pro Python environment
+    if path.basename(executable).lower() == 'arcgispro.exe':
+        set_executable(path.join(exec_prefix, 'python.exe'))
+
+    scratchFolder = mkdtemp(prefix='hel_batch_')
+    results = [None] * len(jobs)
+    try:
+        with ProcessPoolExecutor(workers, initializer=initWorker, initargs=(scratchFolder,)) as pool:
+            futures = {pool.submit(runTractJob, job): i for i, job in enumerate(jobs)}
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except:
+                    AddMsgAndPrint(errorMsg('Batch HEL Determination'), 2)
+                    results[i] = [jobs[i].projectName, None, None, 'Failed', 0, 0, 0.0, 0.0, None, ctime()]
+                SetProgressorLabel(f"Completed {str(done)} of {str(len(jobs))} HEL Determinations...")
+                AddMsgAndPrint(f"\tCompleted {jobs[i].projectName}: {results[i][3]} ({str(done)} of {str(len(jobs))})")
+    finally:
+        rmtree(scratchFolder, ignore_errors=True)
+    return results
+
+
+def createSummaryTable(summaryTable):
+    ''' Create (or replace) the per-tract summary table.'''
+    if Exists(summaryTable):
+        Delete(summaryTable)
+    CreateTable(path.dirname(summaryTable), path.basename(summaryTable))
+    for name, fieldType, length in SUMMARY_FIELDS:
+        AddField(summaryTable, name, fieldType, field_length=length)
+
+
+if __name__ == '__main__':
+    ### Input Parameters ###
+    sources = [source for source in GetParameterAsText(0).split(';') if source.strip()]
+    helLayer = GetParameterAsText(1)
+    inputDEM = GetParameterAsText(2)
+    zUnits = GetParameterAsText(3)
+    use_runoff_ls = GetParameterAsText(4).lower() == 'true'
+    summaryTable = GetParameterAsText(5)
+    workers = int(GetParameterAsText(6) or cpu_count())
+
+    ### Shared Setup; paid once for the whole batch ###
+    if not Exists(support_gdb):
+        AddMsgAndPrint('\nSUPPORT.gdb does not exist in the same path as HEL Tools', 2)
+        exit()
+
+    if not Exists(scratch_gdb):
+        CreateFileGDB(base_dir, 'scratch.gdb')
+
+    if CheckExtension('Spatial') == 'Available':
+        CheckOutExtension('Spatial')
+    else:
+        AddMsgAndPrint('Spatial Analyst Extension not enabled. Please enable Spatial Analyst from Project, Licensing, Configure licensing options. Exiting...', 2)
+        exit()
+
+    try:
+        jobs = [getTractJob(source, zUnits, use_runoff_ls, helLayer, inputDEM) for source in sources]
+        workers = max(1, min(workers, len(jobs)))
+
+        if workers > 1:
+            AddMsgAndPrint(f"\nRunning {str(len(jobs))} HEL Determinations in {str(workers)} worker processes...")
+            results = runTractJobs(jobs, workers)
+        else:
+            results = list()
+            for i, job in enumerate(jobs, 1):
+                SetProgressorLabel(f"Running HEL Determination {str(i)} of {str(len(jobs))}: {job.projectName}...")
+                AddMsgAndPrint(f"\nRunning HEL Determination {str(i)} of {str(len(jobs))}: {job.projectName}")
+                results.append(runTractJob(job))
+
+        createSummaryTable(summaryTable)
+        with InsertCursor(summaryTable, [name for name, fieldType, length in SUMMARY_FIELDS]) as cursor:
+            for row in results:
+                cursor.insertRow(row)
+
+        AddMsgAndPrint(f"\nBatch summary written to {summaryTable}")
+
+    except:
+        AddMsgAndPrint(errorMsg('Batch HEL Determination'), 2)
+
+    finally:
+        CheckInExtension('Spatial')
@@ -1,6 +1,6 @@
 from datetime import date
 from getpass import getuser
-from os import path as os_path, startfile
+from os import makedirs, path as os_path, startfile
 from sys import exit, path as sys_path
 from time import ctime
 
@@ -9,6 +9,7 @@ from arcpy.analysis import Statistics
 from arcpy.da import SearchCursor
 from arcpy.management import AddField, CalculateField, Delete, GetCount, MakeFeatureLayer, Sort
 from arcpy.mp import ArcGISProject
+from jinja2 import Environment, FileSystemBytecodeCache
 
 from hel_utils import AddMsgAndPrint, errorMsg
 
@@ -74,6 +75,15 @@ cpa_026_helc_template_path = os_path.join(templates_dir, 'CPA_026_HELC_Template.
 client_report_template_path = os_path.join(templates_dir, 'Client_Report_Template.docx')
 planner_summary_template_path = os_path.join(templates_dir, 'Planner_Summary_Template.docx')
 
+### Jinja2 Environment for Word Templates ###
+# Patched templates are compiled once per process by docxtpl; the bytecode cache keeps them compiled between sessions
+jinja_cache_dir = os_path.join(templates_dir, 'jinja_cache')
+try:
+    makedirs(jinja_cache_dir, exist_ok=True)
+    jinja_env = Environment(autoescape=True, bytecode_cache=FileSystemBytecodeCache(jinja_cache_dir))
+except OSError:
+    jinja_env = Environment(autoescape=True)
+
 ### Paths to SUPPORT GDB ###
 support_gdb = os_path.join(base_dir, 'SUPPORT.gdb')
 nrcs_addresses_table = os_path.join(support_gdb, 'nrcs_addresses')
@@ -233,7 +243,7 @@ try:
         'fsa_county': fsa_county,
         'nad_address': nad_address
     }
-    customer_letter_template.render(context, autoescape=True)
+    customer_letter_template.render(context, jinja_env, autoescape=True)
     customer_letter_template.save(customer_letter_output)
     AddMsgAndPrint('\nCreated HELC_Letter.docx...', textFilePath=textFilePath)
 except PermissionError:
@@ -374,7 +384,7 @@ try:
         'where_completed': where_completed,
         'data_026_pg1': add_blank_rows(data_026, 18) if len(data_026) < 18 else data_026
     }
-    cpa_026_helc_template.render(context, autoescape=True)
+    cpa_026_helc_template.render(context, jinja_env, autoescape=True)
     cpa_026_helc_template.save(cpa_026_helc_output)
     cpa_026_helc_doc = Document(cpa_026_helc_output)
     cpa_026_helc_composer = Composer(cpa_026_helc_doc)
@@ -437,7 +447,7 @@ try:
         'tract_number': admin_data['tract_number'],
         'data': planner_summary_data
     }
-    planner_summary_template.render(context, autoescape=True)
+    planner_summary_template.render(context, jinja_env, autoescape=True)
     planner_summary_template.save(planner_summary_output)
     AddMsgAndPrint('\nCreated Planner_Summary.docx...', textFilePath=textFilePath)
 except PermissionError:
@@ -478,7 +488,7 @@ except:
 # #             }
 # #         }
 # #     }
-# #     client_report_template.render(context, autoescape=True)
+# #     client_report_template.render(context, jinja_env, autoescape=True)
 # #     client_report_template.save(client_report_output)
 # #     AddMsgAndPrint('\nCreated Client_Report.docx...', textFilePath=textFilePath)
 # # except PermissionError:
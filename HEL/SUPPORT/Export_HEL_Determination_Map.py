@@ -1,16 +1,15 @@
 from getpass import getuser
-from json import loads as json_loads
 from os import path, rename, startfile
 from time import ctime
-from urllib.parse import urlencode
-from urllib.request import urlopen
 
-from arcpy import Describe, env, Exists, GetParameter, GetParameterAsText, ListFeatureClasses, ListRasters, ListTables, SetProgressorLabel
+from arcpy import Describe, env, Exists, GetParameter, GetParameterAsText, ListFeatureClasses, ListRasters, ListTables, SetProgressorLabel, \
+    SpatialReference
 from arcpy.da import Editor, SearchCursor
 from arcpy.management import Compact, Delete, GetCount
 from arcpy.mp import ArcGISProject
 
 from hel_utils import AddMsgAndPrint, errorMsg
+from plss_resolver import resolvePLSS
 
 
 def logBasicSettings(textFilePath, zoom_type, imagery, show_location, plss_method, overwrite_layout):
@@ -33,22 +32,7 @@ def logBasicSettings(textFilePath, zoom_type, imagery, show_location, plss_metho
             f.write('\tOverwrite Determination Map: False\n')
 
 
-def submitFSquery(url, INparams):
-    INparams = INparams.encode('ascii')
-    resp = urlopen(url, INparams)
-    jsonString = resp.read()
-    results = json_loads(jsonString)
-    if 'error' in results.keys():
-        return False
-    else:
-        return results
-
-
 def getPLSS(plss_point):
-    # URLs for BLM services
-    tr_svc = 'https://gis.blm.gov/arcgis/rest/services/Cadastral/BLM_Natl_PLSS_CadNSDI/MapServer/1/query'   # Town and Range
-    sec_svc = 'https://gis.blm.gov/arcgis/rest/services/Cadastral/BLM_Natl_PLSS_CadNSDI/MapServer/2/query'  # Sections
-
     AddMsgAndPrint('\tChecking input PLSS reference point...')
     plssDesc = Describe(plss_point)
     plss_fc = plssDesc.catalogPath
@@ -68,66 +52,11 @@ def getPLSS(plss_point):
             AddMsgAndPrint('\nPlease digitize a single point in the input point parameter and try again. Exiting...', 2)
             exit()
 
-    AddMsgAndPrint('\tInput PLSS location reference is a single point. Using point to query BLM PLSS layers...')
-    jsonPoint = [row[0] for row in SearchCursor(plss_fc, ['SHAPE@JSON'])][0]
+    AddMsgAndPrint('\tInput PLSS location reference is a single point. Resolving PLSS location...')
+    point = [row[0] for row in SearchCursor(plss_fc, ['SHAPE@'], spatial_reference=SpatialReference(4326))][0]
 
-    # Set input parameters for a query to get a count of results
-    params = urlencode({
-        'f': 'json',
-        'geometry':jsonPoint,
-        'geometryType':'esriGeometryPoint',
-        'returnCountOnly':'true'})
-    
-    # Run and check the count query
-    AddMsgAndPrint('\tQuerying BLM Township and Range Layer...')
-    mer_txt = ''
-    countQuery = submitFSquery(tr_svc, params)
-    if countQuery:
-        returned_records = countQuery['count']
-        if returned_records > 0:
-            # Run actual query for the town and range fields
-            params = urlencode({
-                'f': 'json',
-                'geometry':jsonPoint,
-                'geometryType':'esriGeometryPoint',
-                'returnGeometry':'false',
-                'outFields':'PRINMER,TWNSHPNO,TWNSHPDIR,RANGENO,RANGEDIR'})
-            trQuery = submitFSquery(tr_svc,params)
-            rdict = trQuery['features'][0]
-            adict = rdict['attributes']
-            mer_txt = adict['PRINMER']
-            town_no = int(adict['TWNSHPNO'])
-            town_dir = adict['TWNSHPDIR']
-            range_no = int(adict['RANGENO'])
-            range_dir = adict['RANGEDIR']
-
-            if len(mer_txt) > 0 and town_no > 0 and range_no > 0:
-                # Query count the sections service
-                params = urlencode({
-                    'f': 'json',
-                    'geometry':jsonPoint,
-                    'geometryType':'esriGeometryPoint',
-                    'returnCountOnly':'true'})
-                # Run and check the count query
-                AddMsgAndPrint('\tQuerying BLM Sections Layer...')
-                countQuery = submitFSquery(sec_svc, params)
-                if countQuery:
-                    returned_records = countQuery['count']
-                    if returned_records > 0:
-                        # Run actual query for the section field
-                        params = urlencode({
-                            'f': 'json',
-                            'geometry':jsonPoint,
-                            'geometryType':'esriGeometryPoint',
-                            'returnGeometry':'false',
-                            'outFields':'FRSTDIVNO'})
-                        secQuery = submitFSquery(sec_svc, params)
-                        rdict = secQuery['features'][0]
-                        adict = rdict['attributes']
-                        section_no = int(adict['FRSTDIVNO'])
-                        if section_no > 0:
-                            return f"Location: T{str(town_no)}{town_dir}, R{str(range_no)}{range_dir}, Sec {str(section_no)}\n{mer_txt}"
-    return None
+    # Cached locations and a local PLSS section index (SUPPORT.gdb\PLSS_Sections) are used before the BLM services
+    return resolvePLSS(point, path.join(support_gdb, 'PLSS_Sections'))
 
 
 ### Initial Tool Validation ###
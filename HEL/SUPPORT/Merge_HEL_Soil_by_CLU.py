@@ -1,92 +1,198 @@
-from os import path
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count, set_executable
+from os import getpid, makedirs, path
 from pathlib import Path
-from sys import argv, exit
+from shutil import rmtree
+from sys import argv, exec_prefix, executable, exit
+from tempfile import mkdtemp
 
 from arcpy import AddError, AddMessage, Describe, env, Exists, GetParameterAsText, ListFields, SetParameterAsText
 from arcpy.analysis import Clip
-from arcpy.management import CreateFileGDB, Delete, Merge
+from arcpy.management import CopyFeatures, CreateFileGDB, Delete, MakeFeatureLayer, Merge
 
+from soil_cache import getCachedSoils
+from spatial_index import oidWhereClause
 
-# Tool Inputs
-source_clu = GetParameterAsText(0)
-source_soils = GetParameterAsText(1).split(';')
 
-# Paths to SCRATCH.gdb features
-scratch_gdb = path.join(path.dirname(argv[0]), 'SCRATCH.gdb')
-temp_soil = path.join(scratch_gdb, 'temp_soil')
+# Scratch workspace of the current process; each clip worker replaces it with its own geodatabase
+workerScratchGDB = path.join(path.dirname(argv[0]), 'SCRATCH.gdb')
 
-# Output to project base data GDB
-base_data_gdb = Path(Describe(source_clu).catalogPath).parent
-merged_soil = path.join(base_data_gdb, 'Merged_HEL_Soil')
 
-# Project Base Data GDB validation
-if not Exists(base_data_gdb):
-    AddError('\Failed to locate the project Base Data GDB... Exiting')
-    exit()
+def initClipWorker(scratchFolder):
+    ''' Process pool initializer: give the worker its own scratch geodatabase.'''
+    global workerScratchGDB
+    workerScratchGDB = path.join(scratchFolder, f"scratch_{str(getpid())}.gdb")
+    CreateFileGDB(scratchFolder, path.basename(workerScratchGDB))
 
-# Create SCRATCH.gdb if needed, clear any existing features otherwise
-if not Exists(scratch_gdb):
+
+def soilSource(soil):
+    ''' Catalog path of a soil layer and a where clause that keeps its definition query or selection, and whether the
+        layer has a selection. Clip workers run in separate processes that cannot see the map layers.'''
+    desc = Describe(soil)
+    where = getattr(desc, 'whereClause', '') or ''
+    fids = getattr(desc, 'FIDSet', '') or ''
+    if fids:
+        # The selection already lies within the definition query
+        where = oidWhereClause(desc.OIDFieldName, [int(fid) for fid in fids.split(';')])
+    return desc.catalogPath, where, bool(fids)
+
+
+def clipSoil(soil, where, clu, out_clip):
+    ''' Clip a soil dataset, limited to the features matching where when given, to the CLU fields.'''
+    if where:
+        soil = MakeFeatureLayer(soil, f"{path.basename(out_clip)}_source", where).getOutput(0)
+    Clip(soil, clu, out_clip)
+    return out_clip
+
+
+def clipWorker(soil, where, clu, index):
+    ''' Clip one soil dataset to the CLU fields in the scratch workspace of the current process. Returns the clip.'''
+    return clipSoil(soil, where, clu, path.join(workerScratchGDB, f"temp_soil_{str(index)}"))
+
+
+def clipSoils(soils, clu, workers):
+    ''' Clip each (soil dataset, where clause) to the CLU fields, in worker processes when there are several. Returns
+        the clips in input order and the scratch folder of the workers (None when clipped in this process).'''
+    if workers < 2 or len(soils) < 2:
+        return [clipWorker(soil, where, clu, i) for i, (soil, where) in enumerate(soils)], None
+
+    # Inside ArcGIS Pro the interpreter is ArcGISPro.exe; workers must be started with the Pro Python environment
+    if path.basename(executable).lower() == 'arcgispro.exe':
+        set_executable(path.join(exec_prefix, 'python.exe'))
+
+    scratchFolder = mkdtemp(prefix='hel_clip_')
     try:
-        CreateFileGDB(path.dirname(argv[0]), 'SCRATCH.gdb')
+        with ProcessPoolExecutor(min(workers, len(soils)), initializer=initClipWorker, initargs=(scratchFolder,)) as pool:
+            futures = [pool.submit(clipWorker, soil, where, clu, i) for i, (soil, where) in enumerate(soils)]
+            return [future.result() for future in futures], scratchFolder
     except:
-        AddError('Failed to create SCRATCH.gdb in install location... Exiting')
+        rmtree(scratchFolder, ignore_errors=True)
+        raise
+
+
+def mergeClips(clips, merged_soil):
+    ''' Combine the clipped soils into merged_soil. Merge keeps every field of every clip, so fields found in only some
+        of the input soil layers are not dropped.'''
+    Merge(clips, merged_soil)
+
+
+if __name__ == '__main__':
+    # Tool Inputs
+    source_clu = GetParameterAsText(0)
+    source_soils = GetParameterAsText(1).split(';')
+
+    # Paths to SCRATCH.gdb features
+    scratch_gdb = workerScratchGDB
+    temp_soil = path.join(scratch_gdb, 'temp_soil')
+    temp_clu = path.join(scratch_gdb, 'temp_clu')
+
+    # Local soil cache of survey areas by areasymbol and spatialver
+    soil_cache = path.join(path.dirname(argv[0]), 'soil_cache')
+
+    # Output to project base data GDB
+    base_data_gdb = Path(Describe(source_clu).catalogPath).parent
+    merged_soil = path.join(base_data_gdb, 'Merged_HEL_Soil')
+
+    # Project Base Data GDB validation
+    if not Exists(base_data_gdb):
+        AddError('\Failed to locate the project Base Data GDB... Exiting')
         exit()
-else:
-    scratch_features = [temp_soil]
-    for feature in scratch_features:
-        if Exists(feature):
-            Delete(feature)
-
-# Geoprocessing Environment Settings
-env.workspace = scratch_gdb
-env.overwriteOutput = True
-
-# List of valid HEL soil layer schema for the tool (in lower case for comparative purposes)
-schema = ['areasymbol', 'spatialver', 'musym', 'muname', 'muhelcl', 't', 'k', 'r']
-# Check the input soil layers to make sure they contain fields with the same field names
-x = 0
-for layer in source_soils:
-    field_names = [f.name.lower() for f in ListFields(source_soils[x])]
-    for s in schema:
-        if s not in field_names:
-            AddMessage(f"The layer {str(source_soils[x])} is missing field {str(s)}... Exiting")
+
+    # Create SCRATCH.gdb if needed, clear any existing features otherwise
+    if not Exists(scratch_gdb):
+        try:
+            CreateFileGDB(path.dirname(argv[0]), 'SCRATCH.gdb')
+        except:
+            AddError('Failed to create SCRATCH.gdb in install location... Exiting')
             exit()
-    x += 1
-
-# Clip out the soils that were entered
-AddMessage('Clipping inputs...')
-x = 0
-del_list = []
-# Start an empty list that will be used to clean up the temporary clips after merge is done
-while x < len(source_soils):
-    current_soil = source_soils[x].replace("'", '')
-    out_clip = f"{temp_soil}_{str(x)}"
+    else:
+        scratch_features = [temp_soil, temp_clu]
+        for feature in scratch_features:
+            if Exists(feature):
+                Delete(feature)
+
+    # Geoprocessing Environment Settings
+    env.workspace = scratch_gdb
+    env.overwriteOutput = True
+
+    # List of valid HEL soil layer schema for the tool (in lower case for comparative purposes)
+    schema = ['areasymbol', 'spatialver', 'musym', 'muname', 'muhelcl', 't', 'k', 'r']
+    # Check the input soil layers to make sure they contain fields with the same field names
+    x = 0
+    for layer in source_soils:
+        field_names = [f.name.lower() for f in ListFields(source_soils[x])]
+        for s in schema:
+            if s not in field_names:
+                AddMessage(f"The layer {str(source_soils[x])} is missing field {str(s)}... Exiting")
+                exit()
+        x += 1
+
+    # Clip workers run in separate processes that cannot see the map: resolve the soil layers to their catalog paths
+    # with a where clause for any definition query or selection, and copy the selected CLU fields to SCRATCH.gdb
+    soil_layers = [soil.replace("'", '') for soil in source_soils]
+    soil_sources = [soilSource(soil) for soil in soil_layers]
+    CopyFeatures(source_clu, temp_clu)
+
+    # Resolve the survey areas under the fields to the local soil cache so repeat runs in a county skip the source layers;
+    # the cache holds whole survey areas, so layers with a selection are clipped directly
+    AddMessage('Checking soil cache...')
+    clip_soils = list()
+    cache_layers = list()
+    for soil, (soil_path, where, selected) in zip(soil_layers, soil_sources):
+        if selected:
+            AddMessage(f"The layer {soil} has a selection; clipping it directly...")
+            clip_soils.append((soil_path, where))
+        else:
+            cache_layers.append(soil)
     try:
-        Clip(current_soil, source_clu, out_clip)
+        if cache_layers:
+            makedirs(soil_cache, exist_ok=True)
+            clip_soils = [(fc, '') for fc in getCachedSoils(soil_cache, cache_layers, temp_clu, messages=AddMessage)] \
+                + clip_soils
     except:
+        AddMessage('Soil cache unavailable; clipping the input soil layers directly...')
+        clip_soils = [(soil_path, where) for soil_path, where, selected in soil_sources]
+    if not clip_soils:
         AddError('The input fields may not cover the input soil layers. Clip & Merge failed... Exiting')
         exit()
-    if x == 0:
-        # Start list of layers to merge
-        merge_list = str(out_clip)
+
+    if Exists(merged_soil):
+        Delete(merged_soil)
+
+    # A single soil layer is clipped straight to the output; there is nothing to merge
+    if len(clip_soils) == 1:
+        AddMessage('Clipping input...')
+        try:
+            clipSoil(*clip_soils[0], temp_clu, merged_soil)
+        except:
+            AddError('The input fields may not cover the input soil layers. Clip & Merge failed... Exiting')
+            exit()
+
     else:
-        # Append to list
-        merge_list = f"{merge_list};{str(out_clip)}"
-    # Append name of temporary output to the list of temp soil layers to be deleted
-    del_list.append(str(out_clip))
-    x += 1
-
-# Merge Clipped Datasets
-AddMessage('Merging inputs...')
-if Exists(merged_soil):
-    Delete(merged_soil)
-Merge(merge_list, merged_soil, '')
-
-# Delete temporary soils
-AddMessage('Cleaning up...')
-for lyr in del_list:
-    Delete(lyr)
-
-# Add resulting data to map
-AddMessage('Adding layer to map...')
-SetParameterAsText(2, merged_soil)
+        # Clip the soils in parallel, each worker in its own scratch workspace
+        AddMessage(f"Clipping {str(len(clip_soils))} inputs...")
+        try:
+            clips, clip_folder = clipSoils(clip_soils, temp_clu, cpu_count())
+        except:
+            AddError('The input fields may not cover the input soil layers. Clip & Merge failed... Exiting')
+            exit()
+
+        # Merge Clipped Datasets
+        AddMessage('Merging inputs...')
+        try:
+            mergeClips(clips, merged_soil)
+        finally:
+            # Delete temporary soils
+            AddMessage('Cleaning up...')
+            if clip_folder:
+                rmtree(clip_folder, ignore_errors=True)
+            else:
+                for lyr in clips:
+                    Delete(lyr)
+
+    if Exists(temp_clu):
+        Delete(temp_clu)
+
+    # Add resulting data to map
+    AddMessage('Adding layer to map...')
+    SetParameterAsText(2, merged_soil)
@@ -0,0 +1,204 @@
+from collections import namedtuple
+from math import pi, sin
+
+from numpy import ascontiguousarray, digitize, empty, errstate, float64, full, intp, isnan, logical_and, logical_not, \
+    nan, pad, power, sqrt, uint8, where, zeros
+
+
+# Og_HELcode values by soil HEL class
+HEL_CODE = 0
+NHEL_CODE = 1
+PHEL_CODE = 2
+HEL_CODES = {'HEL': HEL_CODE, 'NHEL': NHEL_CODE, 'PHEL': PHEL_CODE, 'NA': NHEL_CODE}
+
+# Cell values of the LiDAR HEL raster; 0 is written as NoData
+HEL_NODATA = 0
+NHEL_CLASS = 1
+HEL_CLASS = 2
+
+# EI greater than 8 is HEL; HEL soils are assigned 9 so they always reclassify to HEL
+EI_THRESHOLD = 8
+HEL_EI_VALUE = 9
+EI_MAX = 100000000
+
+FEET_PER_METER = 3.280839896
+LS_UNIT_LENGTH = 72.6                   # AH537 unit plot length in feet
+SIN_UNIT_SLOPE = sin(5.143 * (pi/180))   # Sine of the 9% unit plot slope used by the REQ equation
+
+# AH537 L factor exponents by percent slope: < 1 = 0.2, 1 to 3 = 0.3, 3 to 5 = 0.4, >= 5 = 0.5
+L_SLOPE_BREAKS = (1, 3, 5)
+L_EXPONENTS = (0.2, 0.3, 0.4, 0.5)
+
+# Number of cells evaluated per block by the LS kernel
+LS_BLOCK_SIZE = 65536
+
+# Rows and columns per tile for tiled execution; the halo covers the 3x3 slope neighborhood
+TILE_SIZE = 2048
+SLOPE_HALO = 1
+
+# Read window (with halo) and write window (without halo) of a tile, in array rows and columns from the upper left
+Tile = namedtuple('Tile', ['readRow', 'readCol', 'readRows', 'readCols', 'row', 'col', 'rows', 'cols'])
+
+
+def slopePercent(surface, cellSize, zFactor=1):
+    ''' Compute percent rise slope of a surface array using the Horn (3rd order finite difference) method used by
+        arcpy.sa.Slope. NaN cells are treated as NoData; NoData or out of bounds neighbors take the center cell value.'''
+    padded = pad(surface.astype(float64, copy=False), 1, mode='constant', constant_values=nan)
+    rows, cols = surface.shape
+    center = padded[1:-1, 1:-1]
+
+    def neighbor(dr, dc):
+        cell = padded[1+dr:rows+1+dr, 1+dc:cols+1+dc]
+        return where(isnan(cell), center, cell)
+
+    a, b, c = neighbor(-1, -1), neighbor(-1, 0), neighbor(-1, 1)
+    d, f = neighbor(0, -1), neighbor(0, 1)
+    g, h, i = neighbor(1, -1), neighbor(1, 0), neighbor(1, 1)
+
+    dzdx = ((c + 2*f + i) - (a + 2*d + g)) / (8 * cellSize)
+    dzdy = ((g + 2*h + i) - (a + 2*b + c)) / (8 * cellSize)
+    return sqrt(dzdx*dzdx + dzdy*dzdy) * (100 * zFactor)
+
+
+def _lsBlock(slope, lengthFT, out, useRunoffLS):
+    ''' Evaluate the LS factor for one block of cells into out. Sine and cosine of the slope angle are derived from
+        percent rise (sin = tan / sec, cos = 1 / sec) so the only transcendental call per cell is a single power.'''
+    tan = slope * 0.01
+    secant = sqrt(tan*tan + 1)
+    sinSlope = tan
+    sinSlope /= secant
+    relLength = lengthFT / LS_UNIT_LENGTH
+
+    if useRunoffLS:
+        # (λ/72.6 * cos)^0.5 * (sin/sin(5.143°))^0.7
+        relLength /= secant
+        sqrt(relLength, out=out)
+        sinSlope /= SIN_UNIT_SLOPE
+        out *= power(sinSlope, 0.7, out=sinSlope)
+        return
+
+    # L factor: (λ/72.6)^m where m is selected by percent slope bin; each cell only evaluates its own branch
+    bins = digitize(slope, L_SLOPE_BREAKS)
+    for i, exponent in enumerate(L_EXPONENTS):
+        selected = bins == i
+        if exponent == 0.5:
+            out[selected] = sqrt(relLength[selected])
+        else:
+            out[selected] = power(relLength[selected], exponent)
+
+    # S factor from AH537, pg 12: 65.41 sin² + 4.56 sin + 0.065
+    out *= (sinSlope*65.41 + 4.56) * sinSlope + 0.065
+
+
+def lsFactor(slope, flowLengthFT, useRunoffLS=False, out=None, blockSize=LS_BLOCK_SIZE):
+    ''' Compute the LS factor from percent slope and flow length in feet. Uses the AH537 S and L factors by default or
+        the Northwest US runoff (REQ) equation when useRunoffLS is True. Cells are processed in blocks of blockSize so
+        no temporary is larger than one block; pass out to write into an existing float64 array.'''
+    slope = ascontiguousarray(slope, dtype=float64)
+    flowLengthFT = ascontiguousarray(flowLengthFT, dtype=float64)
+    if out is None:
+        out = empty(slope.shape, dtype=float64)
+
+    flatSlope, flatLength, flatOut = slope.reshape(-1), flowLengthFT.reshape(-1), out.reshape(-1)
+    with errstate(invalid='ignore', divide='ignore'):
+        for start in range(0, flatSlope.size, blockSize):
+            stop = start + blockSize
+            _lsBlock(flatSlope[start:stop], flatLength[start:stop], flatOut[start:stop], useRunoffLS)
+    return out
+
+
+def helFactor(ls, kFactor, tFactor, rFactor, helCode):
+    ''' Compute the HEL factor: EI (LS * K * R / T) for PHEL cells, 9 for HEL cells and the NHEL code otherwise.'''
+    with errstate(invalid='ignore', divide='ignore'):
+        ei = (ls * kFactor * rFactor) / tFactor
+    return where(helCode == PHEL_CODE, ei, where(helCode == HEL_CODE, HEL_EI_VALUE, helCode))
+
+
+def reclassifyHEL(factor):
+    ''' Reclassify a HEL factor array: 0 to 8 = NHEL_CLASS, 8 to 100000000 = HEL_CLASS, anything else = HEL_NODATA.'''
+    hel = zeros(factor.shape, dtype=uint8)
+    with errstate(invalid='ignore'):
+        valid = logical_and(factor >= 0, factor <= EI_MAX)
+        nhel = logical_and(valid, factor <= EI_THRESHOLD)
+    hel[nhel] = NHEL_CLASS
+    hel[logical_and(valid, logical_not(nhel))] = HEL_CLASS
+    return hel
+
+
+def buildZoneLookup(values):
+    ''' Build a lookup array indexed by zone ID from a {zone ID: value} dict. Missing zones and None values are NaN.'''
+    lookup = full(max(values, default=-1) + 1, nan)
+    for zone, value in values.items():
+        if value is not None:
+            lookup[zone] = value
+    return lookup
+
+
+def lookupByZone(zones, lookup):
+    ''' Gather lookup[zone] for each cell of a zone ID array. NaN zones and zones outside the lookup return NaN.'''
+    if not lookup.size:
+        return full(zones.shape, nan)
+    ids = where(isnan(zones), -1, zones).astype(intp)
+    inLookup = logical_and(ids >= 0, ids < lookup.size)
+    return where(inLookup, lookup[where(inLookup, ids, 0)], nan)
+
+
+def phelWindow(helCode, halo=SLOPE_HALO):
+    ''' Bounding window of the PHEL cells of a helCode array as (top, bottom, left, right) array bounds, extended by
+        halo cells and clamped to the array. Returns None when there are no PHEL cells.'''
+    phel = helCode == PHEL_CODE
+    rows, cols = phel.any(axis=1).nonzero()[0], phel.any(axis=0).nonzero()[0]
+    if not rows.size:
+        return None
+    return (max(rows[0] - halo, 0), min(rows[-1] + 1 + halo, phel.shape[0]),
+            max(cols[0] - halo, 0), min(cols[-1] + 1 + halo, phel.shape[1]))
+
+
+def computeLiDARHEL(surface, flowLength, kFactor, tFactor, rFactor, helCode, cellSize, zFactor=1, lengthFactor=1,
+                    useRunoffLS=False):
+    ''' Compute the LiDAR HEL raster from aligned arrays of the smoothed DEM surface, upstream flow length (DEM linear
+        units), K, T and R factors and Og_HELcode. NaN marks NoData in every input. lengthFactor converts flow length
+        to feet. Returns a uint8 array of NHEL_CLASS, HEL_CLASS and HEL_NODATA cells.
+
+        HEL and NHEL soils keep their original rating, so slope, LS and EI are only evaluated within the bounding
+        window of the PHEL cells; surface and flowLength may be None when there are no PHEL cells.'''
+    phel = helCode == PHEL_CODE
+    hel = reclassifyHEL(where(helCode == HEL_CODE, HEL_EI_VALUE, where(phel, nan, helCode)))
+    window = phelWindow(helCode)
+    if window is None:
+        return hel
+
+    top, bottom, left, right = window
+    slope = slopePercent(surface[top:bottom, left:right], cellSize, zFactor)
+    # Each LS block is read before it is written, so the slope array is reused for the LS output
+    ls = lsFactor(slope, flowLength[top:bottom, left:right] * lengthFactor, useRunoffLS, out=slope)
+    windowHEL = reclassifyHEL(helFactor(ls, kFactor[top:bottom, left:right], tFactor[top:bottom, left:right],
+                                        rFactor[top:bottom, left:right], helCode[top:bottom, left:right]))
+    windowPHEL = phel[top:bottom, left:right]
+    hel[top:bottom, left:right][windowPHEL] = windowHEL[windowPHEL]
+    return hel
+
+
+def iterTiles(nRows, nCols, tileSize=TILE_SIZE, halo=SLOPE_HALO):
+    ''' Yield overlapping tiles covering an nRows x nCols grid. Read windows extend halo cells past the write window
+        on every side, clamped to the grid.'''
+    for row in range(0, nRows, tileSize):
+        rows = min(tileSize, nRows - row)
+        readRow = max(row - halo, 0)
+        readRows = min(row + rows + halo, nRows) - readRow
+        for col in range(0, nCols, tileSize):
+            cols = min(tileSize, nCols - col)
+            readCol = max(col - halo, 0)
+            readCols = min(col + cols + halo, nCols) - readCol
+            yield Tile(readRow, readCol, readRows, readCols, row, col, rows, cols)
+
+
+def computeLiDARHELTiled(readTile, writeTile, nRows, nCols, cellSize, zFactor=1, lengthFactor=1, useRunoffLS=False,
+                         tileSize=TILE_SIZE):
+    ''' Compute the LiDAR HEL raster tile by tile so peak memory is bounded by tileSize rather than the grid size.
+        readTile(tile) must return the computeLiDARHEL input arrays for the tile read window and writeTile(tile, array)
+        receives the uint8 result for the tile write window. Results match computeLiDARHEL on the full grid.'''
+    for tile in iterTiles(nRows, nCols, tileSize, SLOPE_HALO):
+        hel = computeLiDARHEL(*readTile(tile), cellSize, zFactor, lengthFactor, useRunoffLS)
+        top, left = tile.row - tile.readRow, tile.col - tile.readCol
+        writeTile(tile, hel[top:top+tile.rows, left:left+tile.cols])
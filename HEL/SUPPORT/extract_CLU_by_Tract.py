@@ -1,7 +1,7 @@
-from json import dumps as json_dumps, loads as json_loads
+from json import dumps as json_dumps
 from os import path
-from time import gmtime, sleep, strftime
-from urllib import parse, request
+from time import gmtime, strftime
+from urllib import parse
 
 from arcpy import Describe, env, Exists, GetActivePortalURL, GetSigninToken, ListPortalURLs, ListTransformations, \
     ResetProgressor, SetProgressor, SetProgressorLabel, SetProgressorPosition, SpatialReference
@@ -10,7 +10,9 @@ from arcpy.da import InsertCursor
 from arcpy.management import AddField, CreateFeatureclass, Delete, GetCount, Project, Rename
 from arcpy.mp import ArcGISProject
 
+from feature_service import DEFAULT_PAGE_SIZE, FeatureServiceError, iterFeaturePages, queryObjectIds
 from hel_utils import AddMsgAndPrint, errorMsg
+from rest_client import postForm, RESTError
 
 
 def getPortalTokenInfo(portalURL):
@@ -56,13 +58,21 @@ def getPortalTokenInfo(portalURL):
         return False
 
 
+def refreshPortalToken():
+    """ Regenerate the ArcGIS token after the service rejected it; returns the new token string."""
+    AddMsgAndPrint('\tRegenerating ArcGIS Token Information')
+    global portalToken
+    portalToken = GetSigninToken()
+    return portalToken['token']
+
+
 def submitFSquery(url, INparams):
     """ This function will send a spatial query to a web feature service and convert
-        the results into a python structure.  If the results from the service is an
-        error due to an invalid token then a second attempt will be sent with using
-        a newly generated arcgis token.  If the token is good but the request returned
-        with an error a second attempt will be made.  The funciion takes in 2 parameters,
-        the URL to the web service and a query string in URLencoded format.
+        the results into a python structure.  The request is sent through the shared
+        REST client, which reuses keep-alive connections, retries failed requests with
+        exponential backoff and, if the service reports an invalid token, sends the
+        request again with a newly generated arcgis token.  The funciion takes in 2
+        parameters, the URL to the web service and a query string in URLencoded format.
 
         Error produced with invalid token
         {u'error': {u'code': 498, u'details': [], u'message': u'Invalid Token'}}
@@ -70,74 +80,33 @@ def submitFSquery(url, INparams):
         The function returns requested data via a python dictionary"""
 
     try:
-        INparams = INparams.encode('ascii')
-        resp = request.urlopen(url, INparams)  # A failure here will probably throw an HTTP exception
-        responseStatus = resp.getcode()
-        responseMsg = resp.msg
-        jsonString = resp.read()
-
-        # json --> Python; dictionary containing 1 key with a list of lists
-        results = json_loads(jsonString)
-
-        # Check for expired token; Update if expired and try again
-        if 'error' in results.keys():
-            if results['error']['message'] == 'Invalid Token':
-                AddMsgAndPrint('\tRegenerating ArcGIS Token Information')
-
-                # Get new ArcPro Token, update the original portalToken
-                newToken = GetSigninToken()
-                global portalToken
-                portalToken = newToken
-
-                # convert encoded string into python structure and update token
-                # by parsing the encoded query strting into list of (name, value pairs)
-                # i.e [('f', 'json'),('token','U62uXB9Qcd1xjyX1)]
-                # convert to dictionary and update the token in dictionary
-                queryString = parseQueryString(INparams)
-                requestDict = dict(queryString)
-                requestDict.update(token=newToken['token'])
-                newParams = urllibEncode(requestDict)
-                newParams = newParams.encode('ascii')
-
-                # update incoming parameters just in case a 2nd attempt is needed
-                INparams = newParams
-                resp = request.urlopen(url, newParams)  # A failure here will probably throw an HTTP exception
-                responseStatus = resp.getcode()
-                responseMsg = resp.msg
-                jsonString = resp.read()
-                results = json_loads(jsonString)
-
-        # Check results before returning them; Attempt a 2nd request if results are bad.
-        if 'error' in results.keys() or len(results) == 0:
-            sleep(5)
-            resp = request.urlopen(url, INparams)  # A failure here will probably throw an HTTP exception
-            responseStatus = resp.getcode()
-            responseMsg = resp.msg
-            jsonString = resp.read()
-            results = json_loads(jsonString)
-
-            if 'error' in results.keys() or len(results) == 0:
-                AddMsgAndPrint(f"\t2nd Request Attempt Failed - Error Code: {str(responseStatus)} -- {responseMsg} -- {str(results)}", 2)
-                return False
-            else:
-                return results
+        return postForm(url, parse.parse_qsl(INparams, keep_blank_values=True), refreshPortalToken)
 
-        else:
-            return results
-
-    except Exception as e:
-        if int(e.code) >= 500:
-            pass
-        elif int(e.code) >= 400:
-            pass
-        else:
-            AddMsgAndPrint(f"HTTP ERROR = {str(e.code)}", 2)
+    except RESTError as e:
+        AddMsgAndPrint(f"\tRequest Failed - {str(e)}", 2)
+        return False
 
     except:
         AddMsgAndPrint(errorMsg('extract_CLU_by_Tract.py'), 2)
         return False
 
 
+def fetchFSpage(url, params):
+    """ Worker thread counterpart of submitFSquery: sends a page request through the
+        shared REST client without messaging or regenerating the token, both of which
+        arcpy only allows on the main thread. Failures are returned as an 'error'
+        dictionary for the main thread to retry and report."""
+
+    try:
+        return postForm(url, params)
+
+    except RESTError as e:
+        return {'error': {'message': str(e)}}
+
+    except Exception as e:
+        return {'error': {'message': f"{type(e).__name__}: {str(e)}"}}
+
+
 def createOutputFC(metadata, outputWS, shape='POLYGON'):
     """ This function will create an empty polygon feature class within the outputWS
         The feature class will be set to the same spatial reference as the Web Feature
@@ -239,75 +208,102 @@ def createOutputFC(metadata, outputWS, shape='POLYGON'):
         return False
 
 
-def getCLUgeometryByTractQuery(sqlQuery, fc, RESTurl):
+def getCLUgeometryByTractQuery(sqlQuery, fc, RESTurl, pageSize=DEFAULT_PAGE_SIZE):
     """ This funciton will retrieve CLU geometry from the CLU WFS and assemble
         into the CLU fc along with the attributes associated with it.
-        It is intended to receive requests that will return records that are
-        below the WFS record limit"""
+        The object IDs matching the query are requested first and the features
+        are then downloaded in pages of object IDs, several at a time, so tracts
+        above the WFS record limit are returned in full. Each page is inserted
+        into the fc as it arrives."""
 
     try:
-        params = urllibEncode({
+        params = {
             'f': 'json',
             'where': sqlQuery,
             'geometryType': 'esriGeometryPolygon',
             'returnGeometry': 'true',
             'outFields': '*',
             'token': portalToken['token']
-        })
+        }
+
+        # Send request to feature service from the main thread; the token is read at request time in case it was regenerated
+        def query(pageParams):
+            return submitFSquery(RESTurl, urllibEncode(dict(pageParams, token=portalToken['token'])))
 
-        # Send request to feature service; The following dict keys are returned:
-        # ['objectIdFieldName', 'globalIdFieldName', 'geometryType', 'spatialReference', 'fields', 'features']
-        geometry = submitFSquery(RESTurl, params)
+        # Send a page request from a worker thread; workers only read the token
+        def fetchPage(pageParams):
+            return fetchFSpage(RESTurl, dict(pageParams, token=portalToken['token']))
+
+        # Object IDs of the CLU fields; not subject to the WFS record limit
+        objectIdInfo = queryObjectIds(query, params)
 
         # Error from sumbitFSquery function
-        if not geometry:
+        if not objectIdInfo:
             return False
 
-        # make sure the request returned geometry; otherwise return False
-        if not len(geometry['features']):
+        # make sure the request returned records; otherwise return False
+        objectIds = objectIdInfo[1]
+        if not len(objectIds):
             AddMsgAndPrint(f"\nThere were no CLU fields associated with tract Number {str(tractNumber)}. Please review Admin State, County, and Tract Number entered.", 1)
             return False
 
         # Insert Geometry
+        inserted = 0
         with InsertCursor(fc, [fld for fld in fields]) as cur:
-            SetProgressor('step', 'Assembling Geometry', 0, len(geometry['features']), 1)
-
-            # Iterenate through the 'features' key in geometry dict 'features' contains geometry and attributes
-            for rec in geometry['features']:
-                SetProgressorLabel('Assembling Geometry')
-                values = list()
-                polygon = json_dumps(rec['geometry'])   # u'geometry': {u'rings': [[[-89.407702228, 43.334059191999984], [-89.40769642800001, 43.33560779300001]}
-                attributes = rec['attributes']          # u'attributes': {u'land_unit_id': u'73F53BC1-E3F8-4747-B51F-E598EE445E47'}}
-
-                for fld in fields:
-                    if fld == 'SHAPE@JSON':
-                        continue
-
-                    # DATE values need to be converted from Unix Epoch format
-                    # to dd/mm/yyyy format so that it can be inserted into fc.
-                    elif fldsDict[fld][0] == 'DATE':
-                        dateVal = attributes[fld]
-                        if not dateVal in (None, 'null', '', 'Null'):
-                            epochFormat = float(attributes[fld]) # 1609459200000
-                            # Convert to seconds from milliseconds and reformat
-                            localFormat = strftime('%m/%d/%Y', gmtime(epochFormat/1000))   # 01/01/2021
-                            values.append(localFormat)
-                        else:
-                            values.append(None)
+            SetProgressor('step', 'Assembling Geometry', 0, len(objectIds), 1)
+
+            # Iterenate through the 'features' key of each page; 'features' contains geometry and attributes.
+            # A page rejected for an expired token is retried through query, which regenerates the token
+            for features in iterFeaturePages(fetchPage, params, objectIds, pageSize, retryPage=query):
+                SetProgressorLabel(f"Assembling Geometry ({str(inserted)} of {str(len(objectIds))})")
+                for rec in features:
+                    values = list()
+                    polygon = json_dumps(rec['geometry'])   # u'geometry': {u'rings': [[[-89.407702228, 43.334059191999984], [-89.40769642800001, 43.33560779300001]}
+                    attributes = rec['attributes']          # u'attributes': {u'land_unit_id': u'73F53BC1-E3F8-4747-B51F-E598EE445E47'}}
+
+                    for fld in fields:
+                        if fld == 'SHAPE@JSON':
+                            continue
+
+                        # DATE values need to be converted from Unix Epoch format
+                        # to dd/mm/yyyy format so that it can be inserted into fc.
+                        elif fldsDict[fld][0] == 'DATE':
+                            dateVal = attributes[fld]
+                            if not dateVal in (None, 'null', '', 'Null'):
+                                epochFormat = float(attributes[fld]) # 1609459200000
+                                # Convert to seconds from milliseconds and reformat
+                                localFormat = strftime('%m/%d/%Y', gmtime(epochFormat/1000))   # 01/01/2021
+                                values.append(localFormat)
+                            else:
+                                values.append(None)
 
-                    else:
-                        values.append(attributes[fld])
+                        else:
+                            values.append(attributes[fld])
 
-                # geometry goes at the the end
-                values.append(polygon)
-                cur.insertRow(values)
-                SetProgressorPosition()
+                    # geometry goes at the the end
+                    values.append(polygon)
+                    cur.insertRow(values)
+                    inserted += 1
+                    SetProgressorPosition()
 
         ResetProgressor()
         SetProgressorLabel("")
         del cur
+
+        # Every requested field must have been returned
+        if inserted != len(objectIds):
+            AddMsgAndPrint(f"\nOnly {str(inserted)} of {str(len(objectIds))} CLU fields were returned for tract Number {str(tractNumber)}.", 2)
+            return False
         return True
 
+    # A page failed in a worker thread and again when retried on the main thread
+    except FeatureServiceError as e:
+        try: del cur
+        except: pass
+
+        AddMsgAndPrint(f"\t{str(e)}", 2)
+        return False
+
     except:
         try: del cur
         except: pass
@@ -409,7 +405,7 @@ def start(state, county, trctNmbr, outSR, outWS, addCLUtoSoftware=False):
         AddMsgAndPrint(f"Querying USDA-NRCS GeoPortal for CLU fields where: {whereClause}")
 
         # Send geometry request to cluREST API
-        if not getCLUgeometryByTractQuery(whereClause, cluFC, cluRESTurl):
+        if not getCLUgeometryByTractQuery(whereClause, cluFC, cluRESTurl, fsMetadata.get('maxRecordCount', DEFAULT_PAGE_SIZE)):
             try:
                 Delete(cluFC)
             except:
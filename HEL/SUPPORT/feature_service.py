@@ -0,0 +1,69 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Object IDs requested per page when the service does not report its maxRecordCount
+DEFAULT_PAGE_SIZE = 1000
+
+# Pages downloaded at once; twice as many may be held waiting to be consumed in order
+MAX_PAGE_WORKERS = 4
+
+
+class FeatureServiceError(Exception):
+    ''' A page of features could not be downloaded.'''
+    pass
+
+
+def queryObjectIds(query, params):
+    ''' Request only the object IDs matching a query. query(params) sends a request to the layer's /query endpoint
+        and returns the decoded JSON, or False on failure. Returns (OID field name, sorted IDs) or None.'''
+    result = query(dict(params, returnIdsOnly='true', returnGeometry='false'))
+    if not result or 'error' in result:
+        return None
+    return result.get('objectIdFieldName'), sorted(result.get('objectIds') or [])
+
+
+def pageParams(params, objectIds):
+    ''' Query parameters of one page: the original query limited to a batch of object IDs.'''
+    return dict(params, objectIds=','.join(str(oid) for oid in objectIds))
+
+
+def pageFailed(result):
+    ''' True when a page response is missing or reports an error instead of features.'''
+    return not result or 'error' in result or 'features' not in result
+
+
+def _pageFeatures(result):
+    ''' Features of a page response; a failed page raises rather than silently truncating the download.'''
+    if pageFailed(result):
+        error = result.get('error') if result else None
+        message = error.get('message') if isinstance(error, dict) else result
+        raise FeatureServiceError(f"Feature service page request failed: {str(message)}")
+    return result['features']
+
+
+def _pageResult(page, future, retryPage):
+    ''' Features of a downloaded page, retried once through retryPage on the calling thread if it failed.'''
+    response = future.result()
+    if pageFailed(response) and retryPage:
+        response = retryPage(page)
+    return _pageFeatures(response)
+
+
+def iterFeaturePages(query, params, objectIds, pageSize=DEFAULT_PAGE_SIZE, workers=MAX_PAGE_WORKERS, retryPage=None):
+    ''' Download the features of objectIds in pages of pageSize IDs through a pool of worker threads. Yields the
+        feature list of each page in ID order as soon as it and every earlier page have arrived, so callers can
+        insert pages while later ones download. query runs on the worker threads and must not message or change
+        shared state; it returns the decoded JSON or an 'error' response. A failed page is sent once more through
+        retryPage(page params) on the calling thread, where the token can be regenerated and errors reported, and
+        FeatureServiceError is raised if it still fails.'''
+    pageSize = max(1, int(pageSize))
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        pending = deque()
+        for start in range(0, len(objectIds), pageSize):
+            page = pageParams(params, objectIds[start:start+pageSize])
+            pending.append((page, pool.submit(query, page)))
+            if len(pending) >= 2 * workers:
+                yield _pageResult(*pending.popleft(), retryPage)
+        while pending:
+            yield _pageResult(*pending.popleft(), retryPage)
@@ -0,0 +1,61 @@
+from numpy import asarray, cumsum, errstate, float64, full, inf, isnan, logical_not, maximum, moveaxis, nan, pad, where
+
+
+def _windowExtent(size):
+    ''' Cells before and after the processing cell covered by a window of size cells. Even sized windows extend one
+        cell further after the processing cell than before it.'''
+    return (size - 1) // 2, size // 2
+
+
+def _slidingSum(array, size, axis):
+    ''' Sum over a sliding window of size cells along an axis using cumulative sums; cells past the edge count as 0.'''
+    before, after = _windowExtent(size)
+    padWidth = [(0, 0)] * array.ndim
+    padWidth[axis] = (before + 1, after)
+    sums = cumsum(pad(array, padWidth), axis=axis)
+    upper = [slice(None)] * array.ndim
+    lower = [slice(None)] * array.ndim
+    upper[axis] = slice(size, None)
+    lower[axis] = slice(None, -size)
+    return sums[tuple(upper)] - sums[tuple(lower)]
+
+
+def _slidingMax(array, size, axis):
+    ''' Maximum over a sliding window of size cells along an axis using the van Herk/Gil-Werman algorithm: block-wise
+        prefix and suffix maxima give every window maximum in about three comparisons per cell regardless of size.'''
+    if size == 1:
+        return array
+    before = _windowExtent(size)[0]
+    values = moveaxis(array, axis, -1)
+    n = values.shape[-1]
+    blocks = -(-(n + size - 1) // size)
+    padded = full(values.shape[:-1] + (blocks * size,), -inf)
+    padded[..., before:before+n] = values
+
+    blocked = padded.reshape(values.shape[:-1] + (blocks, size))
+    prefix = maximum.accumulate(blocked, axis=-1).reshape(padded.shape)
+    suffix = maximum.accumulate(blocked[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+    return moveaxis(maximum(suffix[..., :n], prefix[..., size-1:size-1+n]), -1, axis)
+
+
+def focalMean(array, width=3, height=3):
+    ''' Mean of a width x height cell rectangle around each cell, like FocalStatistics MEAN with the DATA option:
+        NaN (NoData) cells are ignored and a cell is NoData only when its whole neighborhood is NoData.'''
+    array = asarray(array, dtype=float64)
+    missing = isnan(array)
+    valid = logical_not(missing).astype(float64)
+    total = _slidingSum(_slidingSum(where(missing, 0, array), width, 1), height, 0)
+    count = _slidingSum(_slidingSum(valid, width, 1), height, 0)
+    with errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    mean[count < 0.5] = nan
+    return mean
+
+
+def focalMax(array, width=3, height=3):
+    ''' Maximum of a width x height cell rectangle around each cell, like FocalStatistics MAXIMUM with the DATA
+        option: NaN (NoData) cells are ignored and a cell is NoData only when its whole neighborhood is NoData.'''
+    array = asarray(array, dtype=float64)
+    result = _slidingMax(_slidingMax(where(isnan(array), -inf, array), width, 1), height, 0)
+    result[result == -inf] = nan
+    return result
@@ -0,0 +1,96 @@
+from time import perf_counter
+
+from numpy import arange, asarray, bincount, errstate, float64, minimum, unique, where, zeros
+from numpy.random import default_rng
+
+
+# Original HEL rating of a CLU from its soil HEL values
+HEL_PCT_THRESHOLD = 33.33
+HEL_ACRE_THRESHOLD = 50
+NHEL_PCT_THRESHOLD = 66.67
+
+# A soil polygon is HEL when more than this percent of it is HEL LiDAR cells
+POLYGON_HEL_PCT_THRESHOLD = 50
+
+
+def rateCLUs(helValues, acres, pct):
+    ''' Rate the original HEL value of each CLU from its rounded pivot table row. Columns are checked in order and
+        the first one that is HEL with >= 33.33% or >= 50 acres, or NHEL with > 66.67%, decides the rating; otherwise
+        the last column does. Returns (ratings, deciding column index, HEL >= 33.33% flags, NHEL > 66.67% flags).'''
+    columns = [str(value) for value in helValues]
+    isHEL = zeros(acres.shape, dtype=bool)
+    isNHEL = zeros(acres.shape, dtype=bool)
+    if 'HEL' in columns:
+        i = columns.index('HEL')
+        isHEL[:, i] = (pct[:, i] >= HEL_PCT_THRESHOLD) | (acres[:, i] >= HEL_ACRE_THRESHOLD)
+    if 'NHEL' in columns:
+        i = columns.index('NHEL')
+        isNHEL[:, i] = pct[:, i] > NHEL_PCT_THRESHOLD
+
+    decides = isHEL | isNHEL
+    decides[:, -1] = True
+    column = decides.argmax(axis=1)
+    rows = arange(acres.shape[0])
+    return asarray(columns, dtype=object)[column], column, isHEL[rows, column], isNHEL[rows, column]
+
+
+def ratePolygons(helAcres, polygonAcres):
+    ''' Rate the Final_HEL_Value of soil polygons from their HEL acres: HEL when more than 50% of the polygon is HEL.
+        Returns (ratings, HEL percents capped at 100).'''
+    with errstate(invalid='ignore', divide='ignore'):
+        pct = minimum(asarray(helAcres, dtype=float64) / asarray(polygonAcres, dtype=float64) * 100, 100.0)
+    return where(pct > POLYGON_HEL_PCT_THRESHOLD, 'HEL', 'NHEL').astype(object), pct
+
+
+def sumHELAcresByCLU(cluNumbers, polygonAcres, polygonRatings):
+    ''' Total the acres of HEL rated polygons by CLU; CLUs with only NHEL polygons get 0.
+        Returns (sorted CLU numbers, HEL acres).'''
+    clus, cluIndex = unique(asarray(cluNumbers), return_inverse=True)
+    helAcres = where(asarray(polygonRatings) == 'HEL', asarray(polygonAcres, dtype=float64), 0.0)
+    return clus, bincount(cluIndex.reshape(-1), weights=helAcres, minlength=clus.size)
+
+
+def rateFields(helAcres, cluAcres):
+    ''' Rate CLU fields from their HEL acres and calculated acres: HEL when >= 33.33% or more than 50 acres are HEL.
+        Returns (ratings, HEL percents, NHEL acres, NHEL percents) with percents capped at 100.'''
+    helAcres = asarray(helAcres, dtype=float64)
+    cluAcres = asarray(cluAcres, dtype=float64)
+    with errstate(invalid='ignore', divide='ignore'):
+        helPct = helAcres / cluAcres * 100
+    nhelPct = minimum(100 - helPct, 100.0)
+    helPct = minimum(helPct, 100.0)
+    ratings = where((helPct >= HEL_PCT_THRESHOLD) | (helAcres > HEL_ACRE_THRESHOLD), 'HEL', 'NHEL').astype(object)
+    return ratings, helPct, cluAcres - helAcres, nhelPct
+
+
+def syntheticTract(nPolygons, nCLUs=None, seed=0):
+    ''' Random per-polygon CLU numbers, polygon acres and HEL acres for a tract of nPolygons soil polygons.'''
+    rng = default_rng(seed)
+    nCLUs = nCLUs or max(1, nPolygons // 20)
+    cluNumbers = rng.integers(1, nCLUs + 1, nPolygons)
+    polygonAcres = rng.gamma(2.0, 3.0, nPolygons)
+    helAcres = polygonAcres * rng.uniform(0, 1, nPolygons)
+    return cluNumbers, polygonAcres, helAcres
+
+
+def benchmark(sizes=(10, 100, 1000, 10000, 100000), repeat=5):
+    ''' Time polygon, CLU total and field rule evaluation on synthetic tracts. Returns {nPolygons: best seconds}.'''
+    timings = dict()
+    for nPolygons in sizes:
+        cluNumbers, polygonAcres, helAcres = syntheticTract(nPolygons)
+        best = None
+        for i in range(repeat):
+            start = perf_counter()
+            polygonRatings, polygonPcts = ratePolygons(helAcres, polygonAcres)
+            clus, cluHELAcres = sumHELAcresByCLU(cluNumbers, polygonAcres, polygonRatings)
+            cluAcres = bincount(unique(cluNumbers, return_inverse=True)[1], weights=polygonAcres)
+            rateFields(cluHELAcres, cluAcres)
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[nPolygons] = best
+    return timings
+
+
+if __name__ == '__main__':
+    for nPolygons, seconds in benchmark().items():
+        print(f"{nPolygons:>7} polygons: {seconds * 1000:.3f} ms")
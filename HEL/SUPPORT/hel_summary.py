@@ -0,0 +1,20 @@
+from numpy import around, asarray, bincount, errstate, float64, minimum, unique
+
+
+def pivotAcresByCLU(cluNumbers, helValues, acres):
+    ''' Sum acres by CLU number and HEL value into a CLU x HEL value table, like Statistics (SUM) followed by
+        PivotTable with missing combinations set to 0. Returns (sorted CLU numbers, sorted HEL values, acre table).'''
+    clus, cluIndex = unique(asarray(cluNumbers), return_inverse=True)
+    values, valueIndex = unique(asarray(helValues), return_inverse=True)
+    pairs = cluIndex.reshape(-1) * values.size + valueIndex.reshape(-1)
+    table = bincount(pairs, weights=asarray(acres, dtype=float64), minlength=clus.size * values.size)
+    return clus, values, table.reshape(clus.size, values.size)
+
+
+def roundPivot(acreTable):
+    ''' Acres and percent of CLU acres of each pivot table cell rounded to 0.1 as reported in the Summary by CLU.
+        Percents are capped at 100 to absorb rounding. Returns (CLU acres, rounded acres, rounded percents).'''
+    cluAcres = acreTable.sum(axis=1)
+    with errstate(invalid='ignore', divide='ignore'):
+        pct = minimum(around(acreTable / cluAcres[:, None] * 100, 1), 100.0)
+    return cluAcres, around(acreTable, 1), pct
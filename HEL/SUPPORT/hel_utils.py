@@ -1,8 +1,16 @@
+from collections import namedtuple
+from os import path
 from sys import exc_info
 from traceback import format_exception
 
-from arcpy import AddError, AddMessage, AddWarning
-from arcpy.management import Delete
+from arcpy import AddError, AddMessage, AddWarning, Describe, NumPyArrayToRaster, Raster, RasterToNumPyArray
+from arcpy.management import BuildRasterAttributeTable, DefineProjection, Delete
+from numpy import float64, nan
+
+
+# Describe properties cached per dataset path by describeDataset
+DatasetInfo = namedtuple('DatasetInfo', ['catalogPath', 'spatialReference', 'linearUnitName', 'oidFieldName'])
+datasetInfoCache = dict()
 
 
 def addLyrxByConnectionProperties(map, lyr_name_list, lyrx_layer, gdb_path, visible=True):
@@ -33,15 +41,41 @@ def AddMsgAndPrint(msg, severity=0, textFilePath=None):
         AddError(msg)
 
 
+def arrayToRaster(array, lowerLeft, cellSize, spatialReference, outRaster, noData=None):
+    ''' Save a NumPy array as a raster anchored at lowerLeft and build its attribute table if it is an integer raster.'''
+    outRas = NumPyArrayToRaster(array, lowerLeft, cellSize, cellSize, noData)
+    outRas.save(outRaster)
+    DefineProjection(outRaster, spatialReference)
+    if array.dtype.kind in 'iu':
+        BuildRasterAttributeTable(outRaster, 'Overwrite')
+
+
 def deleteScratchLayers(scratchLayers):
     ''' Delete layers in a given list.'''
     for lyr in scratchLayers:
+        invalidateDataset(lyr)
         try:
             Delete(lyr)
         except:
             continue
 
 
+def describeDataset(dataset):
+    ''' Return the catalog path, spatial reference, linear unit name and OID field of a dataset path, calling Describe
+        only the first time the path is seen. Call invalidateDataset after a tool overwrites the dataset.'''
+    key = path.normcase(str(dataset))
+    if key not in datasetInfoCache:
+        desc = Describe(dataset)
+        spatialReference = getattr(desc, 'spatialReference', None)
+        datasetInfoCache[key] = DatasetInfo(
+            desc.catalogPath,
+            spatialReference,
+            spatialReference.linearUnitName if spatialReference else None,
+            getattr(desc, 'OIDFieldName', None) if getattr(desc, 'hasOID', False) else None
+        )
+    return datasetInfoCache[key]
+
+
 def errorMsg(tool_name):
     ''' Return exception details for logging, ignore sys.exit exceptions.'''
     exc_type, exc_value, exc_traceback = exc_info()
@@ -52,6 +86,28 @@ def errorMsg(tool_name):
         return f"\n\t------------------------- {tool_name} Tool Error -------------------------\n{exc_message}"
 
 
+def clearDatasetCache():
+    ''' Forget every cached describeDataset result. Called at the start of each tool run: in an in-process script tool
+        the module, and so the cache, outlives the run.'''
+    datasetInfoCache.clear()
+
+
+def invalidateDataset(*datasets):
+    ''' Drop cached describeDataset results for datasets that were written, replaced or deleted.'''
+    for dataset in datasets:
+        datasetInfoCache.pop(path.normcase(str(dataset)), None)
+
+
+def rasterToArray(raster, lowerLeft, nCols, nRows):
+    ''' Read a window of a raster into a float64 array with NoData cells set to NaN.'''
+    ras = Raster(raster) if isinstance(raster, str) else raster
+    if ras.isInteger:
+        array = RasterToNumPyArray(ras, lowerLeft, nCols, nRows, -32768).astype(float64)
+        array[array == -32768] = nan
+        return array
+    return RasterToNumPyArray(ras, lowerLeft, nCols, nRows, nan).astype(float64, copy=False)
+
+
 def removeMapLayers(map, map_layers):
     ''' Remove layers from the active map for a given list of lyr objects.'''
     for lyr in map.listLayers():
@@ -0,0 +1,240 @@
+from collections import deque
+from heapq import heapify, heappop, heappush
+from math import sqrt
+
+from numpy import argmin, asarray, ascontiguousarray, bincount, float64, flatnonzero, full, inf, int32, intp, isnan, \
+    logical_and, logical_not, logical_or, maximum, minimum, nan, pad, subtract, uint8, unique, where, zeros
+
+from focal_statistics import focalMax
+
+
+# ArcGIS D8 flow direction codes and their (row, column) offsets: E, SE, S, SW, W, NW, N, NE
+D8_CODES = (1, 2, 4, 8, 16, 32, 64, 128)
+D8_OFFSETS = ((0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1))
+D8_UNDEFINED = 0    # Sinks and NoData cells
+
+
+def _edgeCells(domain):
+    ''' Mask of domain cells that touch a cell outside the domain (grid edge or NoData).'''
+    rows, cols = domain.shape
+    outside = pad(logical_not(domain), 1, constant_values=True)
+    touches = zeros(domain.shape, dtype=bool)
+    for dr in (0, 1, 2):
+        for dc in (0, 1, 2):
+            touches |= outside[dr:dr+rows, dc:dc+cols]
+    return logical_and(domain, touches)
+
+
+def _priorityFlood(elev, domain, seeds):
+    ''' Priority-Flood with a pit queue (Barnes et al. 2014) over the domain cells of a 2-D surface whose outermost
+        rows and columns lie outside the domain. Cells are flooded from the seeds (flat indices) in order of
+        elevation, ties broken by index; a cell reached at or below the water level is raised to it through a FIFO
+        instead of the heap, so only cells above the water level pay the O(log n) heap cost. Every sink is labeled
+        by the spill cell it was entered from. Returns the filled surface, the label of each cell (0 = not in a
+        sink) and the spill level of each label (index 0 unused).'''
+    rows, cols = elev.shape
+    offsets = (-cols-1, -cols, -cols+1, -1, 1, cols-1, cols, cols+1)
+    z = ascontiguousarray(elev, dtype=float64).ravel()
+    filled = z.copy()
+    labels = zeros(z.size, dtype=int32)
+    closed = bytearray(logical_not(domain).ravel().view(uint8))
+    zv, fv, lv = z.data, filled.data, labels.data
+
+    seeds = seeds.tolist()
+    heap = [(zv[s], s) for s in seeds]
+    heapify(heap)
+    for s in seeds:
+        closed[s] = 1
+
+    pit = deque()
+    levels = [nan]
+    while True:
+        if pit:
+            c = pit.popleft()
+            level = fv[c]
+            cLabel = lv[c]
+        elif heap:
+            level, c = heappop(heap)
+            cLabel = 0
+        else:
+            break
+
+        for o in offsets:
+            n = c + o
+            if closed[n]:
+                continue
+            closed[n] = 1
+            zn = zv[n]
+            if zn <= level:
+                if not cLabel:
+                    cLabel = len(levels)
+                    levels.append(level)
+                fv[n] = level
+                lv[n] = cLabel
+                pit.append(n)
+            else:
+                heappush(heap, (zn, n))
+
+    return filled.reshape(rows, cols), labels.reshape(rows, cols), asarray(levels)
+
+
+def _sinkDepths(elev, labels, levels):
+    ''' Depth of each labeled sink: its spill level less its lowest cell (NaN for label 0).'''
+    sink = labels > 0
+    lowest = full(levels.size, inf)
+    minimum.at(lowest, labels[sink], elev[sink])
+    return levels - lowest
+
+
+def _labelBounds(labels, count):
+    ''' Row and column bounds (inclusive) of each label 1..count-1, indexed by label.'''
+    rows, cols = labels.shape
+    cells = flatnonzero(labels)
+    cellLabels = labels.ravel()[cells]
+    bounds = [full(count, rows), full(count, -1), full(count, cols), full(count, -1)]
+    minimum.at(bounds[0], cellLabels, cells // cols)
+    maximum.at(bounds[1], cellLabels, cells // cols)
+    minimum.at(bounds[2], cellLabels, cells % cols)
+    maximum.at(bounds[3], cellLabels, cells % cols)
+    return bounds
+
+
+def fillDepressions(dem, zLimit=None):
+    ''' Fill sinks in a DEM array with the Priority-Flood algorithm in O(n log n). NaN cells are NoData: valid cells
+        on the grid edge or next to NoData are the outlets and are never raised, so results do not depend on the
+        processing order. When zLimit is given it is applied per sink, like the z_limit of arcpy.sa.Fill: a sink
+        whose depth below its pour point exceeds zLimit keeps its elevations, and the sinks nested in it are found by
+        flooding it again from its lowest cell and filled to their own pour points when they are shallow enough.'''
+    elev = pad(asarray(dem, dtype=float64), 1, constant_values=nan)
+    domain = logical_not(isnan(elev))
+    filled, labels, levels = _priorityFlood(elev, domain, flatnonzero(_edgeCells(domain)))
+    if zLimit is None:
+        return filled[1:-1, 1:-1]
+
+    result = elev.copy()
+    pending = [(0, 0, elev, filled, labels, levels)]
+    while pending:
+        top, left, subElev, subFilled, subLabels, subLevels = pending.pop()
+        depth = _sinkDepths(subElev, subLabels, subLevels)
+        shallow = (depth <= zLimit)[subLabels]
+        window = result[top:top+subElev.shape[0], left:left+subElev.shape[1]]
+        window[shallow] = subFilled[shallow]
+
+        # Sinks deeper than zLimit stay unfilled; each is flooded again on its own, with its lowest cell as the outlet
+        deep = flatnonzero(depth > zLimit)
+        if not deep.size:
+            continue
+        rowMin, rowMax, colMin, colMax = _labelBounds(subLabels, subLevels.size)
+        for k in deep.tolist():
+            r0, r1, c0, c1 = rowMin[k] - 1, rowMax[k] + 2, colMin[k] - 1, colMax[k] + 2
+            cropElev = subElev[r0:r1, c0:c1]
+            cropDomain = subLabels[r0:r1, c0:c1] == k
+            outlet = asarray([argmin(where(cropDomain, cropElev, inf))])
+            cropFilled, cropLabels, cropLevels = _priorityFlood(cropElev, cropDomain, outlet)
+            pending.append((top + r0, left + c0, cropElev, cropFilled, cropLabels, cropLevels))
+
+    return result[1:-1, 1:-1]
+
+
+def flowDirectionD8(surface):
+    ''' Compute D8 flow direction codes (1 = E, 2 = SE, 4 = S ... 128 = NE) for a surface array, matching
+        arcpy.sa.FlowDirection with the FORCE option: cells on the grid edge or next to NoData flow outward toward the
+        first missing neighbor. Other cells flow to the neighbor with the steepest drop per unit distance; cells on
+        flats flow toward the nearest flat cell that already drains, and sinks are D8_UNDEFINED.'''
+    rows, cols = surface.shape
+    surface = asarray(surface, dtype=float64)
+    z = pad(surface, 1, constant_values=nan)
+    valid = logical_not(isnan(surface))
+    edge = _edgeCells(valid)
+
+    direction = zeros((rows, cols), dtype=uint8)
+    steepest = full((rows, cols), -inf)
+    outward = zeros((rows, cols), dtype=uint8)
+    for code, (dr, dc) in zip(D8_CODES, D8_OFFSETS):
+        neighbor = z[1+dr:rows+1+dr, 1+dc:cols+1+dc]
+        drop = (surface - neighbor) / (sqrt(2) if dr and dc else 1)
+        steeper = drop > steepest
+        steepest[steeper] = drop[steeper]
+        direction[steeper] = code
+
+    # Edge cells prefer an orthogonal outward direction over a diagonal one
+    for code in D8_CODES[::2] + D8_CODES[1::2]:
+        dr, dc = D8_OFFSETS[D8_CODES.index(code)]
+        missing = isnan(z[1+dr:rows+1+dr, 1+dc:cols+1+dc])
+        outward[logical_and(edge, logical_and(outward == 0, missing))] = code
+
+    # FORCE: every edge cell flows out of the grid; sinks (no lower or equal neighbor) are undefined
+    direction[edge] = outward[edge]
+    flat = logical_and(logical_and(valid, logical_not(edge)), steepest == 0)
+    direction[logical_or(flat, logical_and(logical_not(edge), logical_or(steepest < 0, logical_not(valid))))] = D8_UNDEFINED
+    _resolveFlats(z, direction, flat)
+    return direction
+
+
+def _resolveFlats(z, direction, flat):
+    ''' Route flat cells (no lower neighbor) toward an equal elevation neighbor that already drains, growing outward
+        from the flat's outlets one cell per pass. Flats without an outlet are left D8_UNDEFINED.'''
+    rows, cols = direction.shape
+    width = cols + 2
+    zFlat = z.ravel()
+    drains = pad(direction != D8_UNDEFINED, 1, constant_values=False).ravel()
+    drains[pad(flat, 1, constant_values=False).ravel()] = False
+    direction = direction.ravel()
+
+    # Work in padded flat indices so neighbors never leave the grid
+    remaining = flatnonzero(flat)
+    remaining = (remaining // cols + 1) * width + remaining % cols + 1
+    while remaining.size:
+        assigned = zeros(remaining.size, dtype=uint8)
+        for code, (dr, dc) in zip(D8_CODES, D8_OFFSETS):
+            neighbor = remaining + (dr*width + dc)
+            target = logical_and(assigned == 0, logical_and(drains[neighbor], zFlat[neighbor] == zFlat[remaining]))
+            assigned[target] = code
+        resolved = assigned > 0
+        if not resolved.any():
+            break
+        cells = remaining[resolved]
+        direction[(cells // width - 1) * cols + cells % width - 1] = assigned[resolved]
+        drains[cells] = True
+        remaining = remaining[logical_not(resolved)]
+
+
+def flowLengthUpstream(direction, cellSize):
+    ''' Compute the longest upstream flow path length to each cell from D8 flow direction codes, like
+        arcpy.sa.FlowLength with UPSTREAM. Cells are visited in topological order (Kahn) one frontier at a time;
+        orthogonal steps add cellSize and diagonal steps add cellSize * sqrt(2). Undefined cells end their flow paths.'''
+    rows, cols = direction.shape
+    codes = direction.ravel()
+    receiver = full(codes.size, -1, dtype=intp)
+    distance = zeros(codes.size)
+    cellRows, cellCols = divmod(flatnonzero(codes != D8_UNDEFINED), cols)
+    for code, (dr, dc) in zip(D8_CODES, D8_OFFSETS):
+        flows = codes[cellRows * cols + cellCols] == code
+        r, c = cellRows[flows], cellCols[flows]
+        inside = logical_and(logical_and(r + dr >= 0, r + dr < rows), logical_and(c + dc >= 0, c + dc < cols))
+        r, c = r[inside], c[inside]
+        receiver[r * cols + c] = (r + dr) * cols + c + dc
+        distance[r * cols + c] = cellSize * (sqrt(2) if dr and dc else 1)
+
+    # Kahn traversal: a cell is final once every upstream cell has contributed its length
+    inflow = bincount(receiver[receiver >= 0], minlength=codes.size)
+    length = zeros(codes.size)
+    frontier = flatnonzero(logical_and(inflow == 0, receiver >= 0))
+    while frontier.size:
+        downstream = receiver[frontier]
+        maximum.at(length, downstream, length[frontier] + distance[frontier])
+        subtract.at(inflow, downstream, 1)
+        frontier = unique(downstream[inflow[downstream] == 0])
+        frontier = frontier[receiver[frontier] >= 0]
+    return length.reshape(rows, cols)
+
+
+def computeFlowLength(surface, cellSize, focalMaximum=False):
+    ''' Compute upstream flow length from a surface array in one call, replacing FlowDirection (FORCE), FlowLength
+        (UPSTREAM) and, when focalMaximum is True, the 3x3 MAXIMUM focal statistics pass that follows them.
+        NaN cells in the surface are NoData in the flow length.'''
+    length = flowLengthUpstream(flowDirectionD8(surface), cellSize)
+    length[isnan(surface)] = nan
+    if focalMaximum:
+        return focalMax(length, 3, 3)
+    return length
@@ -0,0 +1,116 @@
+from json import dump, load
+from os import path, replace
+
+from arcpy import Exists
+from arcpy.da import SearchCursor
+from arcpy.management import Delete, MakeFeatureLayer, SelectLayerByLocation
+
+from rest_client import postForm, RESTError
+
+
+# BLM CadNSDI services
+TOWNSHIP_SERVICE = 'https://gis.blm.gov/arcgis/rest/services/Cadastral/BLM_Natl_PLSS_CadNSDI/MapServer/1/query'
+SECTION_SERVICE = 'https://gis.blm.gov/arcgis/rest/services/Cadastral/BLM_Natl_PLSS_CadNSDI/MapServer/2/query'
+
+# Fields of a township and a section; a local section index carries all of them
+TOWNSHIP_FIELDS = ['PRINMER', 'TWNSHPNO', 'TWNSHPDIR', 'RANGENO', 'RANGEDIR']
+SECTION_FIELDS = ['FRSTDIVNO']
+
+# Resolved locations by quantized WGS 1984 point, kept between runs
+PLSS_CACHE_FILE = path.join(path.abspath(path.dirname(__file__)), 'plss_cache.json')
+
+# Grid in decimal degrees (about 1 m) that points are snapped to for the cache key
+POINT_QUANTUM = 0.00001
+
+
+def plssCacheKey(x, y):
+    ''' Cache key of a WGS 1984 point snapped to POINT_QUANTUM.'''
+    return f"{str(round(x / POINT_QUANTUM))}_{str(round(y / POINT_QUANTUM))}"
+
+
+def loadPLSSCache(cacheFile=PLSS_CACHE_FILE):
+    ''' Read the PLSS cache; an empty cache if it is missing or unreadable.'''
+    try:
+        with open(cacheFile, 'r') as f:
+            return load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def savePLSSCache(cache, cacheFile=PLSS_CACHE_FILE):
+    ''' Write the PLSS cache through a temporary file; a read only install just skips caching.'''
+    try:
+        with open(f"{cacheFile}.tmp", 'w') as f:
+            dump(cache, f, indent=2)
+        replace(f"{cacheFile}.tmp", cacheFile)
+    except OSError:
+        pass
+
+
+def formatLocation(attributes):
+    ''' Location text from township and section attributes, or None if any part is missing or zero.'''
+    try:
+        mer_txt = attributes['PRINMER'] or ''
+        town_no = int(attributes['TWNSHPNO'])
+        range_no = int(attributes['RANGENO'])
+        section_no = int(attributes['FRSTDIVNO'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if len(mer_txt) > 0 and town_no > 0 and range_no > 0 and section_no > 0:
+        return f"Location: T{str(town_no)}{attributes['TWNSHPDIR']}, R{str(range_no)}{attributes['RANGEDIR']}, Sec {str(section_no)}\n{mer_txt}"
+    return None
+
+
+def queryLocalSections(sectionsPath, point):
+    ''' Township and section attributes of the local PLSS section polygon containing a point, or None.'''
+    sectionLayer = MakeFeatureLayer(sectionsPath, 'plss_sections').getOutput(0)
+    try:
+        SelectLayerByLocation(sectionLayer, 'INTERSECT', point)
+        with SearchCursor(sectionLayer, TOWNSHIP_FIELDS + SECTION_FIELDS) as cursor:
+            for row in cursor:
+                return dict(zip(TOWNSHIP_FIELDS + SECTION_FIELDS, row))
+    finally:
+        Delete(sectionLayer)
+    return None
+
+
+def queryBLM(url, pointJSON, fields):
+    ''' Attributes of the first BLM feature under a point, or None. Queries features directly; an empty feature list
+        answers the same question as a returnCountOnly request.'''
+    params = {
+        'f': 'json',
+        'geometry': pointJSON,
+        'geometryType': 'esriGeometryPoint',
+        'returnGeometry': 'false',
+        'outFields': ','.join(fields)
+    }
+    try:
+        features = postForm(url, params).get('features')
+    except RESTError:
+        return None
+    return features[0]['attributes'] if features else None
+
+
+def resolvePLSS(point, sectionsPath='', cacheFile=PLSS_CACHE_FILE):
+    ''' Resolve the location text of a WGS 1984 PointGeometry from the PLSS cache, then a local PLSS section index
+        when one exists, then the BLM services. Returns None when the location cannot be resolved.'''
+    cache = loadPLSSCache(cacheFile)
+    key = plssCacheKey(point.firstPoint.X, point.firstPoint.Y)
+    if key in cache:
+        return cache[key]
+
+    location = None
+    if sectionsPath and Exists(sectionsPath):
+        attributes = queryLocalSections(sectionsPath, point)
+        location = formatLocation(attributes) if attributes else None
+
+    if not location:
+        township = queryBLM(TOWNSHIP_SERVICE, point.JSON, TOWNSHIP_FIELDS)
+        if township and formatLocation(dict(township, FRSTDIVNO=1)):
+            section = queryBLM(SECTION_SERVICE, point.JSON, SECTION_FIELDS)
+            location = formatLocation(dict(township, **section)) if section else None
+
+    if location:
+        cache[key] = location
+        savePLSSCache(cache, cacheFile)
+    return location
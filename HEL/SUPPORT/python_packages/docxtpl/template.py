@@ -6,17 +6,19 @@ Created : 2015-03-12
 """
 
 from os import PathLike
-from typing import Any, Optional, IO, Union, Dict, Set
+from typing import Any, Optional, IO, Iterable, Union, Dict, Set
 from .subdoc import Subdoc
-import functools
+from .template_cache import CompiledPart, template_cache
+from .xml_patch import patch_xml
 import io
+from concurrent.futures import ProcessPoolExecutor
 from lxml import etree
 from docx import Document
 from docx.opc.oxml import parse_xml
 from docx.opc.part import XmlPart
 import docx.oxml.ns
 from docx.opc.constants import RELATIONSHIP_TYPE as REL_TYPE
-from jinja2 import Environment, Template, meta
+from jinja2 import Environment, meta
 from jinja2.exceptions import TemplateError
 try:
     from html import escape  # noqa: F401
@@ -36,6 +38,17 @@ class DocxTemplate(object):
     HEADER_URI = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/header"
     FOOTER_URI = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/footer"
 
+    # Patched xml and compiled jinja2 templates shared by all instances;
+    # set to None to patch and compile on every render
+    template_cache = template_cache
+
+    # Characters of a rendered text that resolve_listing() turns into xml
+    listing_chars = re.compile('[\t\a\n\f]')
+
+    # Environment used by render(autoescape=True) when no jinja_env is given,
+    # shared so templates compiled with it can be reused
+    _autoescape_env = None
+
     def __init__(self, template_file: Union[IO[bytes], str, PathLike]) -> None:
         self.template_file = template_file
         self.reset_replacements()
@@ -47,6 +60,9 @@ class DocxTemplate(object):
         if not self.docx or self.is_rendered:
             self.docx = Document(self.template_file)
             self.is_rendered = False
+            self.template_file_key = None
+            if self.template_cache is not None:
+                self.template_file_key = self.template_cache.file_key(self.template_file)
 
     def render_init(self):
         self.init_docx()
@@ -78,170 +94,34 @@ class DocxTemplate(object):
         """ Make a lots of cleaning to have a raw xml understandable by jinja2 :
         strip all unnecessary xml tags, manage table cell background color and colspan,
         unescape html entities, etc... """
+        return patch_xml(src_xml)
 
-        # replace {<something>{ by {{   ( works with {{ }} {% and %} {# and #})
-        src_xml = re.sub(r'(?<={)(<[^>]*>)+(?=[\{%\#])|(?<=[%\}\#])(<[^>]*>)+(?=\})', '',
-                         src_xml, flags=re.DOTALL)
-
-        # replace {{<some tags>jinja2 stuff<some other tags>}} by {{jinja2 stuff}}
-        # same thing with {% ... %} and {# #}
-        # "jinja2 stuff" could a variable, a 'if' etc... anything jinja2 will understand
-        def striptags(m):
-            return re.sub('</w:t>.*?(<w:t>|<w:t [^>]*>)', '',
-                          m.group(0), flags=re.DOTALL)
-        src_xml = re.sub(r'{%(?:(?!%}).)*|{#(?:(?!#}).)*|{{(?:(?!}}).)*', striptags,
-                         src_xml, flags=re.DOTALL)
-
-        # manage table cell colspan
-        def colspan(m):
-            cell_xml = m.group(1) + m.group(3)
-            cell_xml = re.sub(r'<w:r[ >](?:(?!<w:r[ >]).)*<w:t></w:t>.*?</w:r>',
-                              '', cell_xml, flags=re.DOTALL)
-            cell_xml = re.sub(r'<w:gridSpan[^/]*/>', '', cell_xml, count=1)
-            return re.sub(r'(<w:tcPr[^>]*>)', r'\1<w:gridSpan w:val="{{%s}}"/>'
-                          % m.group(2), cell_xml)
-        src_xml = re.sub(r'(<w:tc[ >](?:(?!<w:tc[ >]).)*){%\s*colspan\s+([^%]*)\s*%}(.*?</w:tc>)',
-                         colspan, src_xml, flags=re.DOTALL)
-
-        # manage table cell background color
-        def cellbg(m):
-            cell_xml = m.group(1) + m.group(3)
-            cell_xml = re.sub(r'<w:r[ >](?:(?!<w:r[ >]).)*<w:t></w:t>.*?</w:r>',
-                              '', cell_xml, flags=re.DOTALL)
-            cell_xml = re.sub(r'<w:shd[^/]*/>', '', cell_xml, count=1)
-            return re.sub(r'(<w:tcPr[^>]*>)',
-                          r'\1<w:shd w:val="clear" w:color="auto" w:fill="{{%s}}"/>'
-                          % m.group(2), cell_xml)
-        src_xml = re.sub(r'(<w:tc[ >](?:(?!<w:tc[ >]).)*){%\s*cellbg\s+([^%]*)\s*%}(.*?</w:tc>)',
-                         cellbg, src_xml, flags=re.DOTALL)
-
-        # ensure space preservation
-        src_xml = re.sub(r'<w:t>((?:(?!<w:t>).)*)({{.*?}}|{%.*?%})',
-                         r'<w:t xml:space="preserve">\1\2',
-                         src_xml, flags=re.DOTALL)
-        src_xml = re.sub(r'({{r\s.*?}}|{%r\s.*?%})',
-                         r'</w:t></w:r><w:r><w:t xml:space="preserve">\1</w:t></w:r><w:r><w:t xml:space="preserve">',
-                         src_xml, flags=re.DOTALL)
-
-        # {%- will merge with previous paragraph text
-        src_xml = re.sub(r'</w:t>(?:(?!</w:t>).)*?{%-', '{%', src_xml, flags=re.DOTALL)
-        # -%} will merge with next paragraph text
-        src_xml = re.sub(r'-%}(?:(?!<w:t[ >]|{%|{{).)*?<w:t[^>]*?>', '%}', src_xml, flags=re.DOTALL)
-
-        for y in ['tr', 'tc', 'p', 'r']:
-            # replace into xml code the row/paragraph/run containing
-            # {%y xxx %} or {{y xxx}} template tag
-            # by {% xxx %} or {{ xx }} without any surrounding <w:y> tags :
-            # This is mandatory to have jinja2 generating correct xml code
-            pat = r'<w:%(y)s[ >](?:(?!<w:%(y)s[ >]).)*({%%|{{)%(y)s ([^}%%]*(?:%%}|}})).*?</w:%(y)s>' % {'y': y}
-            src_xml = re.sub(pat, r'\1 \2', src_xml, flags=re.DOTALL)
-
-        for y in ['tr', 'tc', 'p']:
-            # same thing, but for {#y xxx #} (but not where y == 'r', since that
-            # makes less sense to use comments in that context
-            pat = r'<w:%(y)s[ >](?:(?!<w:%(y)s[ >]).)*({#)%(y)s ([^}#]*(?:#})).*?</w:%(y)s>' % {'y': y}
-            src_xml = re.sub(pat, r'\1 \2', src_xml, flags=re.DOTALL)
-
-        # add vMerge
-        # use {% vm %} to make this table cell and its copies be vertically merged within a {% for %}
-        def v_merge_tc(m):
-            def v_merge(m1):
-                return (
-                    '<w:vMerge w:val="{% if loop.first %}restart{% else %}continue{% endif %}"/>' +
-                    m1.group(1) +  # Everything between ``</w:tcPr>`` and ``<w:t>``.
-                    "{% if loop.first %}" +
-                    m1.group(2) +  # Everything before ``{% vm %}``.
-                    m1.group(3) +  # Everything after ``{% vm %}``.
-                    "{% endif %}" +
-                    m1.group(4)  # ``</w:t>``.
-                )
-            return re.sub(
-                r'(</w:tcPr[ >].*?<w:t(?:.*?)>)(.*?)(?:{%\s*vm\s*%})(.*?)(</w:t>)',
-                v_merge,
-                m.group(),  # Everything between ``</w:tc>`` and ``</w:tc>`` with ``{% vm %}`` inside.
-                flags=re.DOTALL,
-            )
-        src_xml = re.sub(r'<w:tc[ >](?:(?!<w:tc[ >]).)*?{%\s*vm\s*%}.*?</w:tc[ >]',
-                         v_merge_tc, src_xml, flags=re.DOTALL)
-
-        # Use ``{% hm %}`` to make table cell become horizontally merged within
-        # a ``{% for %}``.
-        def h_merge_tc(m):
-            xml_to_patch = m.group()  # Everything between ``</w:tc>`` and ``</w:tc>`` with ``{% hm %}`` inside.
-
-            def with_gridspan(m1):
-                return (
-                    m1.group(1) +  # ``w:gridSpan w:val="``.
-                    '{{ ' + m1.group(2) + ' * loop.length }}' +  # Content of ``w:val``, multiplied by loop length.
-                    m1.group(3)  # Closing quotation mark.
-                )
-
-            def without_gridspan(m2):
-                return (
-                    '<w:gridSpan w:val="{{ loop.length }}"/>' +
-                    m2.group(1) +  # Everything between ``</w:tcPr>`` and ``<w:t>``.
-                    m2.group(2) +  # Everything before ``{% hm %}``.
-                    m2.group(3) +  # Everything after ``{% hm %}``.
-                    m2.group(4)  # ``</w:t>``.
-                )
-
-            if re.search(r'w:gridSpan', xml_to_patch):
-                # Simple case, there's already ``gridSpan``, multiply its value.
-
-                xml = re.sub(
-                    r'(w:gridSpan w:val=")(\d+)(")',
-                    with_gridspan,
-                    xml_to_patch,
-                    flags=re.DOTALL,
-                )
-                xml = re.sub(
-                    r'{%\s*hm\s*%}',
-                    '',
-                    xml,  # Patched xml.
-                    flags=re.DOTALL,
-                )
-            else:
-                # There're no ``gridSpan``, add one.
-                xml = re.sub(
-                    r'(</w:tcPr[ >].*?<w:t(?:.*?)>)(.*?)(?:{%\s*hm\s*%})(.*?)(</w:t>)',
-                    without_gridspan,
-                    xml_to_patch,
-                    flags=re.DOTALL,
-                )
-
-            # Discard every other cell generated in loop.
-            return "{% if loop.first %}" + xml + "{% endif %}"
-
-        src_xml = re.sub(r'<w:tc[ >](?:(?!<w:tc[ >]).)*?{%\s*hm\s*%}.*?</w:tc[ >]',
-                         h_merge_tc, src_xml, flags=re.DOTALL)
+    def prepare_xml(self, src_xml):
+        src_xml = self.patch_xml(src_xml)
+        return re.sub(r'<w:p([ >])', r'\n<w:p\1', src_xml)
 
-        def clean_tags(m):
-            return (m.group(0)
-                    .replace(r"&#8216;", "'")
-                    .replace('&lt;', '<')
-                    .replace('&gt;', '>')
-                    .replace(u'“', u'"')
-                    .replace(u'”', u'"')
-                    .replace(u"‘", u"'")
-                    .replace(u"’", u"'"))
-        src_xml = re.sub(r'(?<=\{[\{%])(.*?)(?=[\}%]})', clean_tags, src_xml)
-
-        return src_xml
+    def compile_xml_part(self, xml, part):
+        """ Patch the xml of a part for jinja2, reusing the patched xml and
+        compiled templates cached for the same template file and part xml """
+        if self.template_cache is None:
+            return CompiledPart(self.prepare_xml(xml))
+        return self.template_cache.get_part(self.template_file_key, str(part.partname),
+                                            xml, self.prepare_xml)
 
     def render_xml_part(self, src_xml, part, context, jinja_env=None):
         src_xml = re.sub(r'<w:p([ >])', r'\n<w:p\1', src_xml)
+        return self.render_compiled_part(CompiledPart(src_xml), part, context, jinja_env)
+
+    def render_compiled_part(self, compiled, part, context, jinja_env=None):
         try:
             self.current_rendering_part = part
-            if jinja_env:
-                template = jinja_env.from_string(src_xml)
-            else:
-                template = Template(src_xml)
+            template = compiled.get_template(jinja_env)
             dst_xml = template.render(context)
         except TemplateError as exc:
             if hasattr(exc, 'lineno') and exc.lineno is not None:
                 line_number = max(exc.lineno - 4, 0)
                 exc.docx_context = map(lambda x: re.sub(r'<[^>]+>', '', x),
-                                       src_xml.splitlines()[line_number:(line_number + 7)])
+                                       compiled.src_xml.splitlines()[line_number:(line_number + 7)])
             raise exc
         dst_xml = re.sub(r'\n<w:p([ >])', r'<w:p\1', dst_xml)
         dst_xml = (dst_xml
@@ -253,7 +133,6 @@ class DocxTemplate(object):
         return dst_xml
 
     def resolve_listing(self, xml):
-
         def resolve_text(run_properties, paragraph_properties, m):
             xml = m.group(0).replace('\t', '</w:t></w:r>'
                                      '<w:r>%s<w:tab/></w:r>'
@@ -273,21 +152,46 @@ class DocxTemplate(object):
                           lambda x: resolve_text(run_properties, paragraph_properties, x), m.group(0),
                           flags=re.DOTALL)
 
-        def resolve_paragraph(m):
-            paragraph_properties = re.search(r'<w:pPr>.*?</w:pPr>', m.group(0))
+        def resolve_paragraph(paragraph):
+            paragraph_properties = re.search(r'<w:pPr>.*?</w:pPr>', paragraph)
             paragraph_properties = paragraph_properties.group(0) if paragraph_properties else ''
             return re.sub(r'<w:r(?:[^>]*)?>.*?</w:r>',
                           lambda x: resolve_run(paragraph_properties, x),
-                          m.group(0), flags=re.DOTALL)
-
-        xml = re.sub(r'<w:p(?:[^>]*)?>.*?</w:p>', resolve_paragraph, xml, flags=re.DOTALL)
+                          paragraph, flags=re.DOTALL)
+
+        # Only the paragraphs holding \t, \a, \n or \f are rewritten. The
+        # paragraph of such a character is the one a re.sub() of
+        # r'<w:p(?:[^>]*)?>.*?</w:p>' over the whole xml would match : it
+        # starts at the first '<w:p' after the previous '</w:p>' and ends at
+        # the next '</w:p>'
+        resolved = []
+        last = 0
+        m = self.listing_chars.search(xml)
+        while m:
+            previous_end = xml.rfind('</w:p>', last, m.start())
+            start = xml.find('<w:p', last if previous_end < 0 else previous_end + 6, m.start())
+            if start < 0:
+                m = self.listing_chars.search(xml, m.end())
+                continue
+            end = xml.find('>', start + 4)
+            end = -1 if end < 0 else xml.find('</w:p>', end + 1)
+            if end < 0:
+                break
+            end += 6
+            resolved.append(xml[last:start])
+            resolved.append(resolve_paragraph(xml[start:end]))
+            last = end
+            m = self.listing_chars.search(xml, last)
+        if not resolved:
+            return xml
+        resolved.append(xml[last:])
+        return ''.join(resolved)
 
-        return xml
 
     def build_xml(self, context, jinja_env=None):
         xml = self.get_xml()
-        xml = self.patch_xml(xml)
-        xml = self.render_xml_part(xml, self.docx._part, context, jinja_env)
+        compiled = self.compile_xml_part(xml, self.docx._part)
+        xml = self.render_compiled_part(compiled, self.docx._part, context, jinja_env)
         return xml
 
     def map_tree(self, tree):
@@ -313,8 +217,8 @@ class DocxTemplate(object):
         for relKey, part in self.get_headers_footers(uri):
             xml = self.get_part_xml(part)
             encoding = self.get_headers_footers_encoding(xml)
-            xml = self.patch_xml(xml)
-            xml = self.render_xml_part(xml, part, context, jinja_env)
+            compiled = self.compile_xml_part(xml, part)
+            xml = self.render_compiled_part(compiled, part, context, jinja_env)
             yield relKey, xml.encode(encoding)
 
     def map_headers_footers_xml(self, relKey, xml):
@@ -333,11 +237,7 @@ class DocxTemplate(object):
         # init template working attributes
         self.render_init()
 
-        if autoescape:
-            if not jinja_env:
-                jinja_env = Environment(autoescape=autoescape)
-            else:
-                jinja_env.autoescape = autoescape
+        jinja_env = self.get_jinja_env(jinja_env, autoescape)
 
         # Body
         xml_src = self.build_xml(context, jinja_env)
@@ -366,6 +266,100 @@ class DocxTemplate(object):
         # set rendered flag
         self.is_rendered = True
 
+    def get_jinja_env(self, jinja_env=None, autoescape=False):
+        if autoescape:
+            if not jinja_env:
+                if DocxTemplate._autoescape_env is None:
+                    DocxTemplate._autoescape_env = Environment(autoescape=autoescape)
+                jinja_env = DocxTemplate._autoescape_env
+            else:
+                jinja_env.autoescape = autoescape
+        return jinja_env
+
+    def render_many(
+        self,
+        contexts: Iterable[Dict[str, Any]],
+        output_paths: Iterable[Union[IO[bytes], str, PathLike]],
+        jinja_env: Optional[Environment] = None,
+        autoescape: bool = False,
+        workers: Optional[int] = None
+    ) -> None:
+        """ Render the template once per context and save each result to the
+        output path at the same position.
+
+        The template package is parsed only once : styles, numbering, fonts,
+        media and every other part rendering does not touch are shared by all
+        the outputs, only the body and the headers/footers are rendered again
+        for each context. Relationships added while rendering a context
+        (images, hyperlinks...) are dropped before rendering the next one.
+
+        With workers > 1, the contexts are split between that many worker
+        processes, each parsing the template once. The template must then be a
+        file path and the contexts picklable (no InlineImage or Subdoc built
+        from this instance) ; workers use a new jinja2 Environment with the
+        same autoescape instead of jinja_env.
+        """
+        contexts = list(contexts)
+        output_paths = list(output_paths)
+        if len(contexts) != len(output_paths):
+            raise ValueError("render_many() needs one output path per context")
+
+        if (workers and workers > 1 and len(contexts) > 1 and
+                not hasattr(self.template_file, 'read')):
+            self._render_many_in_pool(contexts, output_paths, autoescape, workers)
+            return
+
+        self.render_init()
+        jinja_env = self.get_jinja_env(jinja_env, autoescape)
+
+        # Parts rendered for each context, patched and compiled once
+        document_part = self.docx._part
+        document_rels = dict(document_part.rels)
+        body = self.compile_xml_part(self.get_xml(), document_part)
+        headers_footers = []
+        for uri in [self.HEADER_URI, self.FOOTER_URI]:
+            for relKey, part in self.get_headers_footers(uri):
+                xml = self.get_part_xml(part)
+                headers_footers.append((relKey, part, self.compile_xml_part(xml, part),
+                                        self.get_headers_footers_encoding(xml)))
+
+        for context, output_path in zip(contexts, output_paths):
+            self.pic_map = {}
+            self.docx_ids_index = 1000
+            self.is_saved = False
+
+            xml = self.render_compiled_part(body, document_part, context, jinja_env)
+            tree = self.fix_tables(xml)
+            self.fix_docpr_ids(tree)
+            # empty the body of the previous context first : lxml is much slower
+            # to detach a whole tree that was moved in from another document
+            self.docx._element.body.clear()
+            self.map_tree(tree)
+
+            for relKey, part, compiled, encoding in headers_footers:
+                # render from the template part, not the one of the previous context
+                document_part.rels[relKey]._target = part
+                xml = self.render_compiled_part(compiled, part, context, jinja_env)
+                self.map_headers_footers_xml(relKey, xml.encode(encoding))
+
+            self.is_rendered = True
+            self.save(output_path)
+
+            for rId in [rId for rId in document_part.rels if rId not in document_rels]:
+                del document_part.rels[rId]
+
+    def _render_many_in_pool(self, contexts, output_paths, autoescape, workers):
+        replacements = (self.crc_to_new_media, self.crc_to_new_embedded,
+                        self.zipname_to_replace, self.pics_to_replace)
+        chunk_size = -(-len(contexts) // workers)
+        with ProcessPoolExecutor(min(workers, len(contexts))) as pool:
+            futures = [pool.submit(_render_many_worker, self.template_file,
+                                   contexts[i:i + chunk_size], output_paths[i:i + chunk_size],
+                                   autoescape, replacements)
+                       for i in range(0, len(contexts), chunk_size)]
+            for future in futures:
+                future.result()
+
     # using of TC tag in for cycle can cause that count of columns does not
     # correspond to real count of columns in row. This function is able to fix it.
     def fix_tables(self, xml):
@@ -373,87 +367,103 @@ class DocxTemplate(object):
         tree = etree.fromstring(xml, parser=parser)
         # get namespace
         ns = '{' + tree.nsmap['w'] + '}'
-        # walk trough xml and find table
-        for t in tree.iter(ns+'tbl'):
-            tblGrid = t.find(ns+'tblGrid')
-            columns = tblGrid.findall(ns+'gridCol')
-            to_add = 0
-            # walk trough all rows and try to find if there is higher cell count
-            for r in t.iter(ns+'tr'):
-                cells = r.findall(ns+'tc')
-                if (len(columns) + to_add) < len(cells):
-                    to_add = len(cells) - len(columns)
-            # is necessary to add columns?
-            if to_add > 0:
-                # at first, calculate width of table according to columns
-                # (we want to preserve it)
-                width = 0.0
-                new_average = None
-                for c in columns:
-                    if not c.get(ns+'w') is None:
-                        width += float(c.get(ns+'w'))
-                # try to keep proportion of table
-                if width > 0:
-                    old_average = width / len(columns)
-                    new_average = width / (len(columns) + to_add)
-                    # scale the old columns
-                    for c in columns:
-                        c.set(ns+'w', str(int(float(c.get(ns+'w')) *
-                                              new_average/old_average)))
-                    # add new columns
-                    for i in range(to_add):
-                        etree.SubElement(tblGrid, ns+'gridCol',
-                                         {ns+'w': str(int(new_average))})
-
-            # Refetch columns after columns addition.
-            columns = tblGrid.findall(ns + 'gridCol')
-            columns_len = len(columns)
-
-            cells_len_max = 0
-
-            def get_cell_len(total, cell):
-                tc_pr = cell.find(ns + 'tcPr')
-                grid_span = None if tc_pr is None else tc_pr.find(ns + 'gridSpan')
-
-                if grid_span is not None:
-                    return total + int(grid_span.get(ns + 'val'))
-
-                return total + 1
-
-            # Calculate max of table cells to compare with `gridCol`.
-            for r in t.iter(ns + 'tr'):
-                cells = r.findall(ns + 'tc')
-                cells_len = functools.reduce(get_cell_len, cells, 0)
-                cells_len_max = max(cells_len_max, cells_len)
-
-            to_remove = columns_len - cells_len_max
-
-            # If after the loop, there're less columns, than
-            # originally was, remove extra `gridCol` declarations.
-            if to_remove > 0:
-                # Have to keep track of the removed width to scale the
-                # table back to its original width.
-                removed_width = 0.0
-
-                for c in columns[-to_remove:]:
-                    removed_width += float(c.get(ns + 'w'))
-
-                    tblGrid.remove(c)
-
-                columns_left = tblGrid.findall(ns + 'gridCol')
-
-                # Distribute `removed_width` across all columns that has
-                # left after extras removal.
-                extra_space = 0
-                if len(columns_left) > 0:
-                    extra_space = removed_width / len(columns_left)
-                    extra_space = int(extra_space)
-
-                for c in columns_left:
-                    c.set(ns+'w', str(int(float(c.get(ns+'w')) + extra_space)))
+
+        # walk trough xml once : count the cells of every row, then add the
+        # columns spanned by its cells (the first gridSpan of their first tcPr)
+        counts = {}  # table -> [max cells, max grid cells] of its rows
+        rows = {}  # row -> [table, cells, grid cells]
+        for elt in tree.iter(ns + 'tbl', ns + 'tr', ns + 'gridSpan'):
+            if elt.tag == ns + 'tbl':
+                counts[elt] = [0, 0]
+            elif elt.tag == ns + 'tr':
+                t = next(elt.iterancestors(ns + 'tbl'), None)
+                if t is not None:
+                    cells_len = len(elt.findall(ns + 'tc'))
+                    rows[elt] = [t, cells_len, cells_len]
+            else:
+                tc_pr = elt.getparent()
+                cell = tc_pr.getparent()
+                row = rows.get(cell.getparent()) if cell is not None else None
+                if (row is not None and cell.tag == ns + 'tc' and
+                        cell.find(ns + 'tcPr') is tc_pr and tc_pr.find(ns + 'gridSpan') is elt):
+                    row[2] += int(elt.get(ns + 'val')) - 1
+
+        for t, cells_len, grid_len in rows.values():
+            counts[t][0] = max(counts[t][0], cells_len)
+            counts[t][1] = max(counts[t][1], grid_len)
+
+        # rows of nested tables also count for the tables around them
+        for t in reversed(list(counts)):
+            parent = next(t.iterancestors(ns + 'tbl'), None)
+            if parent is not None:
+                counts[parent][0] = max(counts[parent][0], counts[t][0])
+                counts[parent][1] = max(counts[parent][1], counts[t][1])
+
+        for t, (cells_max, cells_len_max) in counts.items():
+            self.fix_table_grid(t, ns, cells_max, cells_len_max)
 
         return tree
 
+    def fix_table_grid(self, t, ns, cells_max, cells_len_max):
+        """ Fit the gridCol declarations of a table to its rows : cells_max is
+        the highest count of cells in a row, cells_len_max the same count with
+        the cells spanning several columns counted as many times """
+        tblGrid = t.find(ns+'tblGrid')
+        columns = tblGrid.findall(ns+'gridCol')
+        # is there a row with a higher cell count ?
+        to_add = max(cells_max - len(columns), 0)
+        # is necessary to add columns?
+        if to_add > 0:
+            # at first, calculate width of table according to columns
+            # (we want to preserve it)
+            width = 0.0
+            new_average = None
+            for c in columns:
+                if not c.get(ns+'w') is None:
+                    width += float(c.get(ns+'w'))
+            # try to keep proportion of table
+            if width > 0:
+                old_average = width / len(columns)
+                new_average = width / (len(columns) + to_add)
+                # scale the old columns
+                for c in columns:
+                    c.set(ns+'w', str(int(float(c.get(ns+'w')) *
+                                          new_average/old_average)))
+                # add new columns
+                for i in range(to_add):
+                    etree.SubElement(tblGrid, ns+'gridCol',
+                                     {ns+'w': str(int(new_average))})
+
+        # Refetch columns after columns addition.
+        columns = tblGrid.findall(ns + 'gridCol')
+        columns_len = len(columns)
+
+        to_remove = columns_len - cells_len_max
+
+        # If after the loop, there're less columns, than
+        # originally was, remove extra `gridCol` declarations.
+        if to_remove > 0:
+            # Have to keep track of the removed width to scale the
+            # table back to its original width.
+            removed_width = 0.0
+
+            for c in columns[-to_remove:]:
+                removed_width += float(c.get(ns + 'w'))
+
+                tblGrid.remove(c)
+
+            columns_left = tblGrid.findall(ns + 'gridCol')
+
+            # Distribute `removed_width` across all columns that has
+            # left after extras removal.
+            extra_space = 0
+            if len(columns_left) > 0:
+                extra_space = removed_width / len(columns_left)
+                extra_space = int(extra_space)
+
+            for c in columns_left:
+                c.set(ns+'w', str(int(float(c.get(ns+'w')) + extra_space)))
+
     def fix_docpr_ids(self, tree):
         # some Ids may have some collisions : so renumbering all of them :
         for elt in tree.xpath('//wp:docPr', namespaces=docx.oxml.ns.nsmap):
@@ -743,3 +753,10 @@ class DocxTemplate(object):
         return meta.find_undeclared_variables(parse_content)
 
     undeclared_template_variables = property(get_undeclared_template_variables)
+
+
+def _render_many_worker(template_file, contexts, output_paths, autoescape, replacements):
+    tpl = DocxTemplate(template_file)
+    (tpl.crc_to_new_media, tpl.crc_to_new_embedded,
+     tpl.zipname_to_replace, tpl.pics_to_replace) = replacements
+    tpl.render_many(contexts, output_paths, autoescape=autoescape)
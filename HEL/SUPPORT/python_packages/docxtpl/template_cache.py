@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Created : 2026-10-17
+
+Cache of patched and compiled docx template parts
+"""
+import binascii
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from jinja2 import Template
+
+
+def compile_template(jinja_env, source, name=None):
+    """ Compile source in jinja_env. When the environment has a bytecode cache
+    and a name is given, the compiled code is read from / stored into it :
+    jinja2 itself only uses the bytecode cache for templates got from a loader.
+    The cache is only an optimisation : when it cannot be read or written
+    (read-only or full disk, file locked by another process...) the template
+    is compiled and used without it """
+    bcc = jinja_env.bytecode_cache
+    if bcc is None or name is None:
+        return jinja_env.from_string(source)
+    try:
+        bucket = bcc.get_bucket(jinja_env, name, None, source)
+    except OSError:
+        return jinja_env.from_string(source)
+    code = bucket.code
+    if code is None:
+        code = jinja_env.compile(source, name)
+        bucket.code = code
+        try:
+            bcc.set_bucket(bucket)
+        except OSError:
+            pass
+    return jinja_env.template_class.from_code(jinja_env, code,
+                                              jinja_env.make_globals(None), None)
+
+
+class CompiledPart(object):
+    """ A docx part ready to be rendered : its xml patched for jinja2 and the
+    jinja2 templates compiled from it, one per environment and autoescape mode """
+
+    def __init__(self, src_xml, name=None):
+        self.src_xml = src_xml
+        self.name = name
+        self.default_template = None
+        self.templates = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def get_template(self, jinja_env=None):
+        if jinja_env is None:
+            with self.lock:
+                if self.default_template is None:
+                    self.default_template = Template(self.src_xml)
+                return self.default_template
+
+        # autoescape is applied at compile time : keep one template per mode
+        key = jinja_env.autoescape
+        with self.lock:
+            templates = self.templates.setdefault(jinja_env, {})
+            if key not in templates:
+                name = None if self.name is None else '%s|%r' % (self.name, key)
+                templates[key] = compile_template(jinja_env, self.src_xml, name)
+            return templates[key]
+
+
+class TemplateCache(object):
+    """ LRU cache of CompiledPart objects.
+
+    Entries are keyed by the template file (its real path, mtime and size, or
+    None for a file-like object), the part name and the CRC of the part xml,
+    so a template saved again or a part modified in memory before rendering
+    is patched and compiled again instead of reusing a stale entry """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.parts = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def file_key(template_file):
+        if hasattr(template_file, 'read'):
+            return None
+        path = os.path.realpath(os.fspath(template_file))
+        stat = os.stat(path)
+        return (os.path.normcase(path), stat.st_mtime_ns, stat.st_size)
+
+    def get_part(self, file_key, partname, xml, prepare):
+        """ Return the CompiledPart of the xml of a part, building it with
+        prepare(xml) -> src_xml on a cache miss """
+        key = (file_key, partname, binascii.crc32(xml.encode('utf-8')), len(xml))
+        with self.lock:
+            part = self.parts.get(key)
+            if part is not None:
+                self.parts.move_to_end(key)
+                return part
+
+        name = None
+        if file_key is not None:
+            name = '%s%s' % (os.path.basename(file_key[0]), partname)
+        part = CompiledPart(prepare(xml), name)
+        with self.lock:
+            part = self.parts.setdefault(key, part)
+            self.parts.move_to_end(key)
+            while len(self.parts) > self.maxsize:
+                self.parts.popitem(last=False)
+        return part
+
+    def clear(self):
+        with self.lock:
+            self.parts.clear()
+
+
+# Cache shared by every DocxTemplate of the process
+template_cache = TemplateCache()
@@ -0,0 +1,676 @@
+# -*- coding: utf-8 -*-
+"""
+Created : 2026-10-17
+
+Linear time patching of docx xml for jinja2
+
+patch_xml() produces the same xml as the regular expression cascade kept in
+patch_xml_regex(), but finds the jinja2 tags first and applies each rule around
+them with str.find()/str.rfind() on the element boundaries : the xml between
+tags is only copied, never scanned by tempered-dot patterns such as
+``(?:(?!<w:tc[ >]).)*`` which cost one look-ahead per character of the
+document and per rule. A rule whose tags do not appear costs one search.
+"""
+import re
+import time
+
+
+def _is_start(s, i, tag):
+    """ True when the '<w:x' found at i is an element start tag : '<w:x ' or '<w:x>' """
+    j = i + len(tag)
+    return j < len(s) and s[j] in ' >'
+
+
+def _rfind_start(s, tag, start, end):
+    """ Position of the last '<w:x[ >]' starting in s[start:end], or -1 """
+    i = s.rfind(tag, start, end)
+    while i >= 0 and not _is_start(s, i, tag):
+        i = s.rfind(tag, start, i + len(tag) - 1)
+    return i
+
+
+def _group_by_owner(s, tag, triggers, exact=False):
+    """ Group triggers (start, ...) tuples in increasing order by the last
+    '<w:x[ >]' (or exact string ``tag`` when exact is set) starting before
+    them. Returns a list of (owner position, [triggers]) ; triggers without
+    owner are dropped. """
+    groups = []
+    owner = -1
+    lo = 0
+    for trigger in triggers:
+        p = trigger[0]
+        if exact:
+            i = s.rfind(tag, lo, p)
+        else:
+            i = _rfind_start(s, tag, lo, p)
+        if i >= 0:
+            owner = i
+        lo = p
+        if owner < 0:
+            continue
+        if groups and groups[-1][0] == owner:
+            groups[-1][1].append(trigger)
+        else:
+            groups.append((owner, [trigger]))
+    return groups
+
+
+def _find_all(s, sub):
+    """ Every position of sub in s, overlapping ones included """
+    positions = []
+    i = s.find(sub)
+    while i >= 0:
+        positions.append(i)
+        i = s.find(sub, i + 1)
+    return positions
+
+
+def _openers(s, seconds):
+    """ Every position of '{' followed by one of the characters of seconds """
+    positions = []
+    i = s.find('{')
+    while i >= 0:
+        if i + 1 < len(s) and s[i + 1] in seconds:
+            positions.append(i)
+        i = s.find('{', i + 1)
+    return positions
+
+
+_SPLIT_DELIMITER = re.compile(r'[{%}#](?=<)')
+
+
+def _join_split_delimiters(s):
+    """ {<tags>{ -> {{ and %<tags>} -> %} (also {% {# }} #}) """
+    out = []
+    last = 0
+    size = len(s)
+    for m in _SPLIT_DELIMITER.finditer(s):
+        i = m.end()
+        if i < last:
+            continue
+        r = i
+        while r < size and s[r] == '<':
+            e = s.find('>', r)
+            if e < 0:
+                break
+            r = e + 1
+        if r == i or r == size:
+            continue
+        before, after = s[i - 1], s[r]
+        if (before == '{' and after in '{%#') or (before in '%}#' and after == '}'):
+            out.append(s[last:i])
+            last = r
+    if not out:
+        return s
+    out.append(s[last:])
+    return ''.join(out)
+
+
+_TEXT_BREAK = re.compile('</w:t>.*?(<w:t>|<w:t [^>]*>)', flags=re.DOTALL)
+_CLOSER = {'%': '%}', '#': '#}', '{': '}}'}
+
+
+def _join_tag_texts(s):
+    """ {{<some tags>jinja2 stuff<some other tags>}} -> {{jinja2 stuff}} """
+    out = []
+    last = 0
+    pos = 0
+    while True:
+        p = s.find('{', pos)
+        while p >= 0 and (p + 1 >= len(s) or s[p + 1] not in '%#{'):
+            p = s.find('{', p + 1)
+        if p < 0:
+            break
+        close = s.find(_CLOSER[s[p + 1]], p + 2)
+        end = len(s) if close < 0 else close
+        if s.find('</w:t>', p, end) >= 0:
+            out.append(s[last:p])
+            out.append(_TEXT_BREAK.sub('', s[p:end]))
+            last = end
+        if close < 0:
+            break
+        pos = end
+    if not out:
+        return s
+    out.append(s[last:])
+    return ''.join(out)
+
+
+def _patch_cells(s, trigger, patch_cell):
+    """ colspan / cellbg : the last {% name xxx %} of a cell, up to the next
+    </w:tc>, is replaced by patch_cell(before, xxx, after) """
+    triggers = [(m.start(), m) for m in trigger.finditer(s)]
+    if not triggers:
+        return s
+    out = []
+    last = 0
+    for owner, group in _group_by_owner(s, '<w:tc', triggers):
+        if owner < last:
+            continue
+        for q, m in reversed(group):
+            end = s.find('</w:tc>', m.end())
+            if end >= 0:
+                end += len('</w:tc>')
+                out.append(s[last:owner])
+                out.append(patch_cell(s[owner:q], m.group(1), s[m.end():end]))
+                last = end
+                break
+    if not out:
+        return s
+    out.append(s[last:])
+    return ''.join(out)
+
+
+_EMPTY_RUN = re.compile(r'<w:r[ >](?:(?!<w:r[ >]).)*<w:t></w:t>.*?</w:r>', flags=re.DOTALL)
+_COLSPAN = re.compile(r'{%\s*colspan\s+([^%]*)\s*%}')
+_CELLBG = re.compile(r'{%\s*cellbg\s+([^%]*)\s*%}')
+
+
+def _colspan(before, value, after):
+    cell_xml = _EMPTY_RUN.sub('', before + after)
+    cell_xml = re.sub(r'<w:gridSpan[^/]*/>', '', cell_xml, count=1)
+    return re.sub(r'(<w:tcPr[^>]*>)', r'\1<w:gridSpan w:val="{{%s}}"/>'
+                  % value, cell_xml)
+
+
+def _cellbg(before, value, after):
+    cell_xml = _EMPTY_RUN.sub('', before + after)
+    cell_xml = re.sub(r'<w:shd[^/]*/>', '', cell_xml, count=1)
+    return re.sub(r'(<w:tcPr[^>]*>)',
+                  r'\1<w:shd w:val="clear" w:color="auto" w:fill="{{%s}}"/>'
+                  % value, cell_xml)
+
+
+def _preserve_spaces(s):
+    """ <w:t> holding a jinja2 tag -> <w:t xml:space="preserve"> """
+    triggers = [(p,) for p in _openers(s, '{%')]
+    if not triggers:
+        return s
+    out = []
+    last = 0
+    for owner, group in _group_by_owner(s, '<w:t>', triggers, exact=True):
+        if owner < last:
+            continue
+        for (p,) in reversed(group):
+            close = s.find('}}' if s[p + 1] == '{' else '%}', p + 2)
+            if close >= 0:
+                out.append(s[last:owner])
+                out.append('<w:t xml:space="preserve">')
+                last = owner + len('<w:t>')
+                out.append(s[last:close + 2])
+                last = close + 2
+                break
+    if not out:
+        return s
+    out.append(s[last:])
+    return ''.join(out)
+
+
+_RUN_TAG_START = re.compile(r'{([{%])r\s')
+
+
+def _split_run_tags(s):
+    """ {{r xxx}} / {%r xxx%} get a run of their own """
+    out = []
+    last = 0
+    pos = 0
+    while True:
+        m = _RUN_TAG_START.search(s, pos)
+        if not m:
+            break
+        p = m.start()
+        close = s.find('}}' if m.group(1) == '{' else '%}', m.end())
+        if close < 0:
+            pos = p + 1
+            continue
+        out.append(s[last:p])
+        out.append('</w:t></w:r><w:r><w:t xml:space="preserve">%s'
+                   '</w:t></w:r><w:r><w:t xml:space="preserve">' % s[p:close + 2])
+        last = pos = close + 2
+    if not out:
+        return s
+    out.append(s[last:])
+    return ''.join(out)
+
+
+def _merge_previous_text(s):
+    """ {%- merges with the previous paragraph text """
+    triggers = [(p,) for p in _find_all(s, '{%-')]
+    if not triggers:
+        return s
+    out = []
+    last = 0
+    for owner, group in _group_by_owner(s, '</w:t>', triggers, exact=True):
+        if owner < last:
+            continue
+        p = group[0][0]
+        out.append(s[last:owner])
+        out.append('{%')
+        last = p + 3
+    if not out:
+        return s
+    out.append(s[last:])
+    return ''.join(out)
+
+
+def _merge_next_text(s):
+    """ -%} merges with the next paragraph text """
+    out = []
+    last = 0
+    p = s.find('-%}')
+    while p >= 0:
+        stops = [i for i in (s.find('<w:t', p + 3), s.find('{%', p + 3), s.find('{{', p + 3))
+                 if i >= 0]
+        stop = min(stops) if stops else -1
+        if stop >= 0 and s.startswith('<w:t', stop):
+            end = s.find('>', stop) + 1
+            out.append(s[last:p])
+            out.append('%}')
+            last = end
+            p = s.find('-%}', end)
+        else:
+            p = s.find('-%}', p + 1)
+    if not out:
+        return s
+    out.append(s[last:])
+    return ''.join(out)
+
+
+_TAG_REST = re.compile(r'[^}%]*(?:%}|}})')
+_COMMENT_REST = re.compile(r'[^}#]*(?:#})')
+
+
+def _unwrap(s, y, openers, rest):
+    """ <w:y ...>...{%y xxx %}...</w:y> -> {% xxx %} (also {{y }} and {#y #}) """
+    triggers = []
+    for opener in openers:
+        for p in _find_all(s, '%s%s ' % (opener, y)):
+            m = rest.match(s, p + len(opener) + len(y) + 1)
+            if m:
+                triggers.append((p, opener, m))
+    if not triggers:
+        return s
+    triggers.sort(key=lambda trigger: trigger[0])
+    out = []
+    last = 0
+    close_tag = '</w:%s>' % y
+    for owner, group in _group_by_owner(s, '<w:%s' % y, triggers):
+        if owner < last:
+            continue
+        for p, opener, m in reversed(group):
+            end = s.find(close_tag, m.end())
+            if end >= 0:
+                out.append(s[last:owner])
+                out.append('%s %s' % (opener, m.group(0)))
+                last = end + len(close_tag)
+                break
+    if not out:
+        return s
+    out.append(s[last:])
+    return ''.join(out)
+
+
+_VM = re.compile(r'{%\s*vm\s*%}')
+_HM = re.compile(r'{%\s*hm\s*%}')
+
+
+def _cell_end(s, start):
+    """ End of the next '</w:tc[ >]' at or after start, or -1 """
+    i = s.find('</w:tc', start)
+    while i >= 0 and not (i + 6 < len(s) and s[i + 6] in ' >'):
+        i = s.find('</w:tc', i + 1)
+    return -1 if i < 0 else i + 7
+
+
+def _merge_cells(s, trigger, patch_cell):
+    """ vm / hm : the cell holding the first {% vm %} / {% hm %}, up to the
+    next </w:tc, is replaced by patch_cell(cell) """
+    triggers = [(m.start(), m) for m in trigger.finditer(s)]
+    if not triggers:
+        return s
+    out = []
+    last = 0
+    for owner, group in _group_by_owner(s, '<w:tc', triggers):
+        if owner < last:
+            continue
+        end = _cell_end(s, group[0][1].end())
+        if end >= 0:
+            out.append(s[last:owner])
+            out.append(patch_cell(s[owner:end]))
+            last = end
+    if not out:
+        return s
+    out.append(s[last:])
+    return ''.join(out)
+
+
+def _v_merge_tc(cell):
+    def v_merge(m1):
+        return (
+            '<w:vMerge w:val="{% if loop.first %}restart{% else %}continue{% endif %}"/>' +
+            m1.group(1) +  # Everything between ``</w:tcPr>`` and ``<w:t>``.
+            "{% if loop.first %}" +
+            m1.group(2) +  # Everything before ``{% vm %}``.
+            m1.group(3) +  # Everything after ``{% vm %}``.
+            "{% endif %}" +
+            m1.group(4)  # ``</w:t>``.
+        )
+    return re.sub(
+        r'(</w:tcPr[ >].*?<w:t(?:.*?)>)(.*?)(?:{%\s*vm\s*%})(.*?)(</w:t>)',
+        v_merge,
+        cell,  # Everything between ``</w:tc>`` and ``</w:tc>`` with ``{% vm %}`` inside.
+        flags=re.DOTALL,
+    )
+
+
+def _h_merge_tc(cell):
+    xml_to_patch = cell  # Everything between ``</w:tc>`` and ``</w:tc>`` with ``{% hm %}`` inside.
+
+    def with_gridspan(m1):
+        return (
+            m1.group(1) +  # ``w:gridSpan w:val="``.
+            '{{ ' + m1.group(2) + ' * loop.length }}' +  # Content of ``w:val``, multiplied by loop length.
+            m1.group(3)  # Closing quotation mark.
+        )
+
+    def without_gridspan(m2):
+        return (
+            '<w:gridSpan w:val="{{ loop.length }}"/>' +
+            m2.group(1) +  # Everything between ``</w:tcPr>`` and ``<w:t>``.
+            m2.group(2) +  # Everything before ``{% hm %}``.
+            m2.group(3) +  # Everything after ``{% hm %}``.
+            m2.group(4)  # ``</w:t>``.
+        )
+
+    if re.search(r'w:gridSpan', xml_to_patch):
+        # Simple case, there's already ``gridSpan``, multiply its value.
+        xml = re.sub(r'(w:gridSpan w:val=")(\d+)(")', with_gridspan,
+                     xml_to_patch, flags=re.DOTALL)
+        xml = re.sub(r'{%\s*hm\s*%}', '', xml, flags=re.DOTALL)
+    else:
+        # There're no ``gridSpan``, add one.
+        xml = re.sub(r'(</w:tcPr[ >].*?<w:t(?:.*?)>)(.*?)(?:{%\s*hm\s*%})(.*?)(</w:t>)',
+                     without_gridspan, xml_to_patch, flags=re.DOTALL)
+
+    # Discard every other cell generated in loop.
+    return "{% if loop.first %}" + xml + "{% endif %}"
+
+
+def _clean_text(text):
+    return (text
+            .replace(r"&#8216;", "'")
+            .replace('&lt;', '<')
+            .replace('&gt;', '>')
+            .replace(u'“', u'"')
+            .replace(u'”', u'"')
+            .replace(u"‘", u"'")
+            .replace(u"’", u"'"))
+
+
+def _tag_end(s, start):
+    """ Position of the next '}}' or '%}' at or after start, or -1 """
+    ends = [i for i in (s.find('}}', start), s.find('%}', start)) if i >= 0]
+    return min(ends) if ends else -1
+
+
+def _clean_tags(s):
+    """ unescape html entities and smart quotes inside {{ }} and {% %} """
+    out = []
+    last = 0
+    for p in _openers(s, '{%'):
+        start = p + 2
+        if start < last:
+            continue
+        end = _tag_end(s, start)
+        if end == start:
+            # re.sub() follows an empty match with a non empty one at the same place
+            end = _tag_end(s, start + 1)
+        if end < 0:
+            break
+        if s.find('\n', start, end) >= 0:
+            continue
+        text = s[start:end]
+        cleaned = _clean_text(text)
+        if cleaned != text:
+            out.append(s[last:start])
+            out.append(cleaned)
+        else:
+            out.append(s[last:end])
+        last = end
+    if not out:
+        return s
+    out.append(s[last:])
+    return ''.join(out)
+
+
+def patch_xml(src_xml):
+    """ Make a lots of cleaning to have a raw xml understandable by jinja2 :
+    strip all unnecessary xml tags, manage table cell background color and colspan,
+    unescape html entities, etc... """
+    xml = _join_split_delimiters(src_xml)
+    xml = _join_tag_texts(xml)
+    xml = _patch_cells(xml, _COLSPAN, _colspan)
+    xml = _patch_cells(xml, _CELLBG, _cellbg)
+    xml = _preserve_spaces(xml)
+    xml = _split_run_tags(xml)
+    xml = _merge_previous_text(xml)
+    xml = _merge_next_text(xml)
+    for y in ['tr', 'tc', 'p', 'r']:
+        xml = _unwrap(xml, y, ('{%', '{{'), _TAG_REST)
+    for y in ['tr', 'tc', 'p']:
+        xml = _unwrap(xml, y, ('{#',), _COMMENT_REST)
+    xml = _merge_cells(xml, _VM, _v_merge_tc)
+    xml = _merge_cells(xml, _HM, _h_merge_tc)
+    xml = _clean_tags(xml)
+    return xml
+
+
+def patch_xml_regex(src_xml):
+    """ Reference implementation of patch_xml() : the regular expression
+    cascade DocxTemplate.patch_xml() used before, kept to check and time
+    the linear version against it """
+
+    # replace {<something>{ by {{   ( works with {{ }} {% and %} {# and #})
+    src_xml = re.sub(r'(?<={)(<[^>]*>)+(?=[\{%\#])|(?<=[%\}\#])(<[^>]*>)+(?=\})', '',
+                     src_xml, flags=re.DOTALL)
+
+    # replace {{<some tags>jinja2 stuff<some other tags>}} by {{jinja2 stuff}}
+    # same thing with {% ... %} and {# #}
+    # "jinja2 stuff" could a variable, a 'if' etc... anything jinja2 will understand
+    def striptags(m):
+        return re.sub('</w:t>.*?(<w:t>|<w:t [^>]*>)', '',
+                      m.group(0), flags=re.DOTALL)
+    src_xml = re.sub(r'{%(?:(?!%}).)*|{#(?:(?!#}).)*|{{(?:(?!}}).)*', striptags,
+                     src_xml, flags=re.DOTALL)
+
+    # manage table cell colspan
+    def colspan(m):
+        cell_xml = m.group(1) + m.group(3)
+        cell_xml = re.sub(r'<w:r[ >](?:(?!<w:r[ >]).)*<w:t></w:t>.*?</w:r>',
+                          '', cell_xml, flags=re.DOTALL)
+        cell_xml = re.sub(r'<w:gridSpan[^/]*/>', '', cell_xml, count=1)
+        return re.sub(r'(<w:tcPr[^>]*>)', r'\1<w:gridSpan w:val="{{%s}}"/>'
+                      % m.group(2), cell_xml)
+    src_xml = re.sub(r'(<w:tc[ >](?:(?!<w:tc[ >]).)*){%\s*colspan\s+([^%]*)\s*%}(.*?</w:tc>)',
+                     colspan, src_xml, flags=re.DOTALL)
+
+    # manage table cell background color
+    def cellbg(m):
+        cell_xml = m.group(1) + m.group(3)
+        cell_xml = re.sub(r'<w:r[ >](?:(?!<w:r[ >]).)*<w:t></w:t>.*?</w:r>',
+                          '', cell_xml, flags=re.DOTALL)
+        cell_xml = re.sub(r'<w:shd[^/]*/>', '', cell_xml, count=1)
+        return re.sub(r'(<w:tcPr[^>]*>)',
+                      r'\1<w:shd w:val="clear" w:color="auto" w:fill="{{%s}}"/>'
+                      % m.group(2), cell_xml)
+    src_xml = re.sub(r'(<w:tc[ >](?:(?!<w:tc[ >]).)*){%\s*cellbg\s+([^%]*)\s*%}(.*?</w:tc>)',
+                     cellbg, src_xml, flags=re.DOTALL)
+
+    # ensure space preservation
+    src_xml = re.sub(r'<w:t>((?:(?!<w:t>).)*)({{.*?}}|{%.*?%})',
+                     r'<w:t xml:space="preserve">\1\2',
+                     src_xml, flags=re.DOTALL)
+    src_xml = re.sub(r'({{r\s.*?}}|{%r\s.*?%})',
+                     r'</w:t></w:r><w:r><w:t xml:space="preserve">\1</w:t></w:r><w:r><w:t xml:space="preserve">',
+                     src_xml, flags=re.DOTALL)
+
+    # {%- will merge with previous paragraph text
+    src_xml = re.sub(r'</w:t>(?:(?!</w:t>).)*?{%-', '{%', src_xml, flags=re.DOTALL)
+    # -%} will merge with next paragraph text
+    src_xml = re.sub(r'-%}(?:(?!<w:t[ >]|{%|{{).)*?<w:t[^>]*?>', '%}', src_xml, flags=re.DOTALL)
+
+    for y in ['tr', 'tc', 'p', 'r']:
+        # replace into xml code the row/paragraph/run containing
+        # {%y xxx %} or {{y xxx}} template tag
+        # by {% xxx %} or {{ xx }} without any surrounding <w:y> tags :
+        # This is mandatory to have jinja2 generating correct xml code
+        pat = r'<w:%(y)s[ >](?:(?!<w:%(y)s[ >]).)*({%%|{{)%(y)s ([^}%%]*(?:%%}|}})).*?</w:%(y)s>' % {'y': y}
+        src_xml = re.sub(pat, r'\1 \2', src_xml, flags=re.DOTALL)
+
+    for y in ['tr', 'tc', 'p']:
+        # same thing, but for {#y xxx #} (but not where y == 'r', since that
+        # makes less sense to use comments in that context
+        pat = r'<w:%(y)s[ >](?:(?!<w:%(y)s[ >]).)*({#)%(y)s ([^}#]*(?:#})).*?</w:%(y)s>' % {'y': y}
+        src_xml = re.sub(pat, r'\1 \2', src_xml, flags=re.DOTALL)
+
+    # add vMerge
+    # use {% vm %} to make this table cell and its copies be vertically merged within a {% for %}
+    def v_merge_tc(m):
+        def v_merge(m1):
+            return (
+                '<w:vMerge w:val="{% if loop.first %}restart{% else %}continue{% endif %}"/>' +
+                m1.group(1) +  # Everything between ``</w:tcPr>`` and ``<w:t>``.
+                "{% if loop.first %}" +
+                m1.group(2) +  # Everything before ``{% vm %}``.
+                m1.group(3) +  # Everything after ``{% vm %}``.
+                "{% endif %}" +
+                m1.group(4)  # ``</w:t>``.
+            )
+        return re.sub(
+            r'(</w:tcPr[ >].*?<w:t(?:.*?)>)(.*?)(?:{%\s*vm\s*%})(.*?)(</w:t>)',
+            v_merge,
+            m.group(),  # Everything between ``</w:tc>`` and ``</w:tc>`` with ``{% vm %}`` inside.
+            flags=re.DOTALL,
+        )
+    src_xml = re.sub(r'<w:tc[ >](?:(?!<w:tc[ >]).)*?{%\s*vm\s*%}.*?</w:tc[ >]',
+                     v_merge_tc, src_xml, flags=re.DOTALL)
+
+    # Use ``{% hm %}`` to make table cell become horizontally merged within
+    # a ``{% for %}``.
+    def h_merge_tc(m):
+        xml_to_patch = m.group()  # Everything between ``</w:tc>`` and ``</w:tc>`` with ``{% hm %}`` inside.
+
+        def with_gridspan(m1):
+            return (
+                m1.group(1) +  # ``w:gridSpan w:val="``.
+                '{{ ' + m1.group(2) + ' * loop.length }}' +  # Content of ``w:val``, multiplied by loop length.
+                m1.group(3)  # Closing quotation mark.
+            )
+
+        def without_gridspan(m2):
+            return (
+                '<w:gridSpan w:val="{{ loop.length }}"/>' +
+                m2.group(1) +  # Everything between ``</w:tcPr>`` and ``<w:t>``.
+                m2.group(2) +  # Everything before ``{% hm %}``.
+                m2.group(3) +  # Everything after ``{% hm %}``.
+                m2.group(4)  # ``</w:t>``.
+            )
+
+        if re.search(r'w:gridSpan', xml_to_patch):
+            # Simple case, there's already ``gridSpan``, multiply its value.
+
+            xml = re.sub(
+                r'(w:gridSpan w:val=")(\d+)(")',
+                with_gridspan,
+                xml_to_patch,
+                flags=re.DOTALL,
+            )
+            xml = re.sub(
+                r'{%\s*hm\s*%}',
+                '',
+                xml,  # Patched xml.
+                flags=re.DOTALL,
+            )
+        else:
+            # There're no ``gridSpan``, add one.
+            xml = re.sub(
+                r'(</w:tcPr[ >].*?<w:t(?:.*?)>)(.*?)(?:{%\s*hm\s*%})(.*?)(</w:t>)',
+                without_gridspan,
+                xml_to_patch,
+                flags=re.DOTALL,
+            )
+
+        # Discard every other cell generated in loop.
+        return "{% if loop.first %}" + xml + "{% endif %}"
+
+    src_xml = re.sub(r'<w:tc[ >](?:(?!<w:tc[ >]).)*?{%\s*hm\s*%}.*?</w:tc[ >]',
+                     h_merge_tc, src_xml, flags=re.DOTALL)
+
+    def clean_tags(m):
+        return (m.group(0)
+                .replace(r"&#8216;", "'")
+                .replace('&lt;', '<')
+                .replace('&gt;', '>')
+                .replace(u'“', u'"')
+                .replace(u'”', u'"')
+                .replace(u"‘", u"'")
+                .replace(u"’", u"'"))
+    src_xml = re.sub(r'(?<=\{[\{%])(.*?)(?=[\}%]})', clean_tags, src_xml)
+
+    return src_xml
+
+
+def synthetic_template(rows):
+    """ body xml of a Word table of ``rows`` rows, as Word saves it : jinja2
+    tags split over several runs, smart quotes, a {%tr for %} loop every 50 rows """
+    def run(text, attrs=''):
+        return ('<w:r><w:rPr><w:rFonts w:ascii="Arial"/><w:sz w:val="18"/></w:rPr>'
+                '<w:t%s>%s</w:t></w:r>' % (attrs, text))
+
+    def cell(*runs):
+        return ('<w:tc><w:tcPr><w:tcW w:w="2310" w:type="dxa"/></w:tcPr>'
+                '<w:p><w:pPr><w:jc w:val="center"/></w:pPr>%s</w:p></w:tc>' % ''.join(runs))
+
+    def row(*cells):
+        return '<w:tr w:rsidR="00A1B2C3">%s</w:tr>' % ''.join(cells)
+
+    xml = ['<w:body><w:p>', run('{{ ', ' xml:space="preserve"'), run('header'),
+           run(' }}', ' xml:space="preserve"'), '</w:p><w:tbl><w:tblPr/>']
+    for i in range(rows):
+        if i % 50 == 0:
+            xml.append(row(cell(run('{%'), run('tr for r in rows[‘t%d’] %%}' % i))))
+            xml.append(row(cell(run('{{ r.'), run('field }}')),
+                           cell(run('{{ r[‘acres’] }}')),
+                           cell(run('{'), run('{ r.hel }}'))))
+            xml.append(row(cell(run('{%tr endfor %}'))))
+        else:
+            xml.append(row(cell(run('Row %d' % i)), cell(run('&lt;static&gt;')),
+                           cell(run('text', ' xml:space="preserve"'))))
+    xml.append('</w:tbl><w:p>%s</w:p></w:body>' % run('{{ footer }}'))
+    return ''.join(xml)
+
+
+def benchmark(sizes=(500, 2000, 5000), repeat=3):
+    """ Time patch_xml() against patch_xml_regex() on synthetic templates,
+    checking both give the same xml """
+    print('%8s %10s %12s %12s %8s' % ('rows', 'xml chars', 'regex (s)', 'linear (s)', 'speedup'))
+    for rows in sizes:
+        xml = synthetic_template(rows)
+        timings = []
+        for patch in (patch_xml_regex, patch_xml):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = patch(xml)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append((best, result))
+        (regex_time, expected), (linear_time, result) = timings
+        if result != expected:
+            raise AssertionError('patch_xml() differs from patch_xml_regex() for %d rows' % rows)
+        print('%8d %10d %12.4f %12.4f %7.1fx' % (rows, len(xml), regex_time, linear_time,
+                                                  regex_time / linear_time))
+
+
+if __name__ == '__main__':
+    benchmark()
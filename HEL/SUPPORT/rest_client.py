@@ -0,0 +1,165 @@
+from base64 import b64encode
+from gzip import decompress
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from json import loads as json_loads
+from random import uniform
+from threading import Lock
+from time import sleep
+from urllib.parse import unquote, urlencode, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+
+# Attempts per request, including the first
+MAX_ATTEMPTS = 4
+
+# Exponential backoff between attempts: a random delay of up to BACKOFF_BASE * 2^attempt seconds, capped
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+# Seconds to wait on a connection or response
+TIMEOUT = 60
+
+# HTTP status and ArcGIS error codes worth retrying, and the error codes of an invalid or expired token
+RETRY_CODES = {429, 500, 502, 503, 504}
+TOKEN_CODES = {498, 499}
+
+# Idle keep-alive connections shared by every thread: {(scheme, host, port, proxy URL): [connection]}. A connection
+# is taken out for one request at a time and put back once its response has been read
+idleConnections = dict()
+poolLock = Lock()
+
+# Idle connections kept per host
+MAX_IDLE_CONNECTIONS = 8
+
+
+class RESTError(Exception):
+    ''' A REST request failed after its retries or returned an error that is not worth retrying.'''
+    pass
+
+
+def backoffDelay(attempt):
+    ''' Seconds to wait before retrying attempt n (0 based): exponential with full jitter.'''
+    return uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def proxyFor(scheme, host):
+    ''' Proxy URL for a host from the system or environment proxy settings, as urllib applies them, or None.'''
+    proxy = getproxies().get(scheme)
+    if not proxy or proxy_bypass(host):
+        return None
+    return proxy if '//' in proxy else f"http://{proxy}"
+
+
+def proxyHeaders(proxy):
+    ''' Proxy-Authorization header for the user:password of a proxy URL, if it has one.'''
+    parts = urlsplit(proxy)
+    if not parts.username:
+        return dict()
+    credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+    return {'Proxy-Authorization': f"Basic {b64encode(credentials.encode('utf-8')).decode('ascii')}"}
+
+
+def openConnection(scheme, host, port, proxy):
+    ''' Open an HTTP/1.1 connection to a host, or to the proxy when one is set: https is tunneled through the proxy
+        with CONNECT, http requests are sent to the proxy with absolute URLs.'''
+    connectionClass = HTTPSConnection if scheme == 'https' else HTTPConnection
+    if not proxy:
+        return connectionClass(host, port, timeout=TIMEOUT)
+    proxyParts = urlsplit(proxy)
+    connection = connectionClass(proxyParts.hostname, proxyParts.port, timeout=TIMEOUT)
+    if scheme == 'https':
+        connection.set_tunnel(host, port, proxyHeaders(proxy))
+    return connection
+
+
+def getConnection(key):
+    ''' Take an idle keep-alive connection for key from the shared pool, or open one.'''
+    with poolLock:
+        idle = idleConnections.get(key)
+        if idle:
+            return idle.pop()
+    return openConnection(*key)
+
+
+def releaseConnection(key, connection):
+    ''' Put a connection whose response has been read back in the shared pool, or close it if the pool is full.'''
+    with poolLock:
+        idle = idleConnections.setdefault(key, list())
+        if len(idle) < MAX_IDLE_CONNECTIONS:
+            idle.append(connection)
+            return
+    connection.close()
+
+
+def closeConnections():
+    ''' Close every idle keep-alive connection.'''
+    with poolLock:
+        idle = [connection for connections in idleConnections.values() for connection in connections]
+        idleConnections.clear()
+    for connection in idle:
+        connection.close()
+
+
+def _post(url, params):
+    ''' POST form encoded params over a pooled connection, through the system or environment proxy if one applies.
+        Returns (HTTP status, decoded body text).'''
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    proxy = proxyFor(parts.scheme, parts.hostname)
+    target = parts.path + (f"?{parts.query}" if parts.query else '')
+    headers = {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'Accept-Encoding': 'gzip',
+        'Connection': 'keep-alive'
+    }
+    # A plain http request goes to the proxy itself, addressed by its full URL
+    if proxy and parts.scheme != 'https':
+        target = f"{parts.scheme}://{parts.netloc}{target}"
+        headers.update(proxyHeaders(proxy))
+
+    key = (parts.scheme, parts.hostname, port, proxy)
+    connection = getConnection(key)
+    try:
+        connection.request('POST', target, urlencode(params).encode('utf-8'), headers)
+        response = connection.getresponse()
+        body = response.read()
+    except (HTTPException, OSError):
+        connection.close()
+        raise
+    if response.getheader('Connection', '').lower() == 'close':
+        connection.close()
+    else:
+        releaseConnection(key, connection)
+    if response.getheader('Content-Encoding', '').lower() == 'gzip':
+        body = decompress(body)
+    return response.status, body.decode('utf-8')
+
+
+def postForm(url, params, refreshToken=None, attempts=MAX_ATTEMPTS):
+    ''' POST a query to an ArcGIS REST endpoint and return the decoded JSON response. Connection failures, throttling
+        and server errors are retried with exponential backoff; an invalid token is replaced by refreshToken() (which
+        returns a new token string) and the request sent again. Raises RESTError when the request cannot succeed.'''
+    params = dict(params)
+    tokenRefreshed = False
+    attempt = 0
+    while True:
+        try:
+            status, text = _post(url, params)
+            results = json_loads(text) if status < 400 else dict()
+            error = results.get('error') if results else {'code': status if status >= 400 else 503, 'message': 'Empty response'}
+        except (HTTPException, OSError, ValueError) as e:
+            error = {'code': 503, 'message': str(e)}
+
+        if not error:
+            return results
+
+        code = int(error.get('code') or 0)
+        if (code in TOKEN_CODES or error.get('message') == 'Invalid Token') and refreshToken and not tokenRefreshed:
+            params['token'] = refreshToken()
+            tokenRefreshed = True
+            continue
+
+        attempt += 1
+        if code not in RETRY_CODES or attempt >= attempts:
+            raise RESTError(f"Error Code: {str(code)} -- {error.get('message')} -- {url}")
+        sleep(backoffDelay(attempt - 1))
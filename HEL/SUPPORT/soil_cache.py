@@ -0,0 +1,256 @@
+from hashlib import sha1
+from json import dump, load
+from os import path, replace, scandir
+from time import time
+
+from arcpy import Describe, Exists
+from arcpy.analysis import Select
+from arcpy.da import InsertCursor, SearchCursor, UpdateCursor
+from arcpy.management import AddFields, CreateFeatureclass, CreateFileGDB, Delete, Dissolve, MakeFeatureLayer, \
+    SelectLayerByLocation
+
+
+# Disk budget of the local soil cache; least recently used survey areas are evicted beyond it
+SOIL_CACHE_BUDGET_MB = 2048
+
+# Manifest of the cache entries: {key: {'source', 'source_path', 'areasymbol', 'spatialver', 'bytes', 'last_used'}}
+CACHE_MANIFEST = 'soil_cache.json'
+
+# Feature class name of a survey area inside its cache geodatabase
+SURVEY_AREA_FC = 'soil'
+
+# Boundaries of the cached survey areas by cache key, so the survey areas under the CLU fields are found without a
+# spatial query of the source soil layers
+SURVEY_AREA_INDEX = path.join('survey_areas.gdb', 'survey_area')
+
+# CLU area outside the cached survey area boundaries that is still treated as covered (slivers along the edges)
+COVERAGE_TOLERANCE_ACRES = 0.01
+
+
+def spatialVersionText(spatialver):
+    ''' Spatial version as text; numeric versions read as 3.0 are written 3.'''
+    try:
+        version = float(spatialver)
+        return str(int(version)) if version.is_integer() else str(version)
+    except (TypeError, ValueError):
+        return str(spatialver)
+
+
+def sourceIdentity(soilLayer):
+    ''' Source ID of a soil layer or dataset: a short hash of its catalog path and definition query, so cache entries
+        are only served to the source they were copied from.'''
+    desc = Describe(soilLayer)
+    whereClause = getattr(desc, 'whereClause', '') or ''
+    return sha1(f"{path.normcase(desc.catalogPath)}|{whereClause}".encode('utf-8')).hexdigest()[:8], desc.catalogPath
+
+
+def surveyAreaKey(source, areasymbol, spatialver):
+    ''' Cache key and geodatabase base name of a survey area at a spatial version from a source, e.g.
+        IA001_3_1f2e3d4c.'''
+    return f"{str(areasymbol).strip().upper()}_{spatialVersionText(spatialver)}_{source}"
+
+
+def surveyAreaPath(cacheFolder, key):
+    ''' Path of the cached survey area feature class for a key.'''
+    return path.join(cacheFolder, f"{key}.gdb", SURVEY_AREA_FC)
+
+
+def loadManifest(cacheFolder):
+    ''' Read the cache manifest; an empty manifest if it is missing or unreadable.'''
+    try:
+        with open(path.join(cacheFolder, CACHE_MANIFEST), 'r') as f:
+            return load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def saveManifest(cacheFolder, manifest):
+    ''' Write the cache manifest through a temporary file so an interrupted run never leaves it truncated.'''
+    manifestPath = path.join(cacheFolder, CACHE_MANIFEST)
+    with open(f"{manifestPath}.tmp", 'w') as f:
+        dump(manifest, f, indent=2)
+    replace(f"{manifestPath}.tmp", manifestPath)
+
+
+def entryBytes(cacheFolder, key):
+    ''' Disk size of a cache entry geodatabase.'''
+    gdb = path.join(cacheFolder, f"{key}.gdb")
+    return sum(entry.stat().st_size for entry in scandir(gdb) if entry.is_file()) if path.isdir(gdb) else 0
+
+
+def deleteEntry(cacheFolder, key):
+    ''' Remove a cache entry from disk and its boundary from the survey area index.'''
+    gdb = path.dirname(surveyAreaPath(cacheFolder, key))
+    if Exists(gdb):
+        Delete(gdb)
+    indexPath = path.join(cacheFolder, SURVEY_AREA_INDEX)
+    if Exists(indexPath):
+        with UpdateCursor(indexPath, ['cache_key'], f"cache_key = '{key}'") as cursor:
+            for row in cursor:
+                cursor.deleteRow()
+
+
+def evictEntries(cacheFolder, manifest, budgetBytes, keep=()):
+    ''' Evict the least recently used entries until the cache fits budgetBytes. Entries in keep are never evicted.
+        Returns the evicted keys.'''
+    evicted = list()
+    total = sum(entry['bytes'] for entry in manifest.values())
+    for key in sorted(manifest, key=lambda k: manifest[k]['last_used']):
+        if total <= budgetBytes:
+            break
+        if key in keep:
+            continue
+        deleteEntry(cacheFolder, key)
+        total -= manifest.pop(key)['bytes']
+        evicted.append(key)
+    return evicted
+
+
+def surveyAreasUnderCLU(soilLayer, cluLayer):
+    ''' Return the set of (areasymbol, spatialver) of the soil polygons intersecting the CLU fields. Only attributes of
+        the selected polygons are read.'''
+    soilSelection = MakeFeatureLayer(soilLayer, 'soil_survey_areas').getOutput(0)
+    try:
+        SelectLayerByLocation(soilSelection, 'INTERSECT', cluLayer)
+        with SearchCursor(soilSelection, ['areasymbol', 'spatialver']) as cursor:
+            return {(areasymbol, spatialver) for areasymbol, spatialver in cursor}
+    finally:
+        Delete(soilSelection)
+
+
+def surveyAreaVersions(soilLayer, areasymbols):
+    ''' Spatial versions of survey areas in a source soil layer, read from attributes only:
+        {upper case areasymbol: set of spatial version text}.'''
+    symbols = ','.join(f"'{str(areasymbol)}'" for areasymbol in sorted(areasymbols))
+    versions = dict()
+    with SearchCursor(soilLayer, ['areasymbol', 'spatialver'], f"areasymbol IN ({symbols})") as cursor:
+        for areasymbol, spatialver in cursor:
+            versions.setdefault(str(areasymbol).strip().upper(), set()).add(spatialVersionText(spatialver))
+    return versions
+
+
+def cachedSurveyAreasUnderCLU(cacheFolder, manifest, cluLayer, sources):
+    ''' Return the cache keys of the survey areas cached from sources ({source ID: soil layer}) whose boundaries
+        intersect the CLU fields. Returns None when part of a CLU field is outside those boundaries or a source now
+        holds another spatial version of one of the survey areas; the source soil layers must be queried then.'''
+    indexPath = path.join(cacheFolder, SURVEY_AREA_INDEX)
+    if not Exists(indexPath):
+        return None
+    cluSR = Describe(cluLayer).spatialReference
+    with SearchCursor(indexPath, ['cache_key', 'SHAPE@'], spatial_reference=cluSR) as cursor:
+        boundaries = [(key, shape) for key, shape in cursor if manifest.get(key, dict()).get('source') in sources]
+
+    keys = list()
+    with SearchCursor(cluLayer, ['SHAPE@'], spatial_reference=cluSR) as cursor:
+        for cluShape, in cursor:
+            uncovered = cluShape
+            for key, shape in boundaries:
+                if not cluShape.disjoint(shape):
+                    uncovered = uncovered.difference(shape)
+                    if key not in keys:
+                        keys.append(key)
+            if uncovered.getArea('PLANAR', 'ACRES') > COVERAGE_TOLERANCE_ACRES:
+                return None
+    if not keys:
+        return None
+
+    # The cached spatial versions must still be the ones in the source
+    for source, soilLayer in sources.items():
+        entries = [manifest[key] for key in keys if manifest[key]['source'] == source]
+        if not entries:
+            continue
+        versions = surveyAreaVersions(soilLayer, {entry['areasymbol'] for entry in entries})
+        if any(versions.get(entry['areasymbol'].strip().upper()) != {entry['spatialver']} for entry in entries):
+            return None
+    return keys
+
+
+def indexSurveyArea(cacheFolder, key, fc):
+    ''' Dissolve a cached survey area to its boundary and record it in the survey area index.'''
+    indexPath = path.join(cacheFolder, SURVEY_AREA_INDEX)
+    if not Exists(indexPath):
+        if not Exists(path.dirname(indexPath)):
+            CreateFileGDB(cacheFolder, path.basename(path.dirname(indexPath)))
+        CreateFeatureclass(path.dirname(indexPath), path.basename(indexPath), 'POLYGON',
+                           spatial_reference=Describe(fc).spatialReference)
+        AddFields(indexPath, [['cache_key', 'TEXT', '', 50]])
+
+    boundary = path.join('in_memory', 'survey_area_boundary')
+    Dissolve(fc, boundary)
+    try:
+        with SearchCursor(boundary, ['SHAPE@']) as cursor:
+            shapes = [row[0] for row in cursor if row[0]]
+    finally:
+        Delete(boundary)
+    if shapes:
+        with InsertCursor(indexPath, ['SHAPE@', 'cache_key']) as cursor:
+            cursor.insertRow([shapes[0], key])
+
+
+def cacheSurveyArea(cacheFolder, soilLayer, key, areasymbol, spatialver):
+    ''' Copy every polygon of a survey area at a spatial version from a source soil layer into the cache under key and
+        record its boundary in the survey area index. Returns the cached feature class.'''
+    deleteEntry(cacheFolder, key)
+    fc = surveyAreaPath(cacheFolder, key)
+    CreateFileGDB(cacheFolder, path.basename(path.dirname(fc)))
+    versionClause = 'spatialver IS NULL' if spatialver is None else f"spatialver = {spatialVersionText(spatialver)}"
+    Select(soilLayer, fc, f"areasymbol = '{str(areasymbol)}' AND {versionClause}")
+    indexSurveyArea(cacheFolder, key, fc)
+    return fc
+
+
+def getCachedSoils(cacheFolder, sourceSoils, cluLayer, budgetMB=SOIL_CACHE_BUDGET_MB, messages=None):
+    ''' Resolve the survey areas under the CLU fields in each source soil layer to feature classes in the local soil
+        cache, copying the survey areas that are missing or at another spatial version. Entries are kept per source
+        (catalog path and definition query); sources must not carry a selection, which the cache cannot represent.
+        The cached survey area boundaries of the sources are checked first and their spatial versions confirmed from
+        the source attributes; the source soil layers are only queried spatially when the boundaries do not cover
+        the CLU fields or a version changed. Returns the cached feature classes of the survey areas in the order
+        found.'''
+    manifest = loadManifest(cacheFolder)
+    sources, sourcePaths = dict(), dict()
+    for soilLayer in sourceSoils:
+        source, catalogPath = sourceIdentity(soilLayer)
+        sources.setdefault(source, soilLayer)
+        sourcePaths[source] = catalogPath
+
+    cachedKeys = cachedSurveyAreasUnderCLU(cacheFolder, manifest, cluLayer, sources)
+    if cachedKeys is not None and all(Exists(surveyAreaPath(cacheFolder, key)) for key in cachedKeys):
+        for key in cachedKeys:
+            if messages:
+                messages(f"Using cached soil survey area {key}...")
+            manifest[key]['last_used'] = time()
+        evictEntries(cacheFolder, manifest, budgetMB * 1024 * 1024, cachedKeys)
+        saveManifest(cacheFolder, manifest)
+        return [surveyAreaPath(cacheFolder, key) for key in cachedKeys]
+
+    current = list()
+    for source, soilLayer in sources.items():
+        for areasymbol, spatialver in sorted(surveyAreasUnderCLU(soilLayer, cluLayer), key=str):
+            key = surveyAreaKey(source, areasymbol, spatialver)
+            if key not in manifest or not Exists(surveyAreaPath(cacheFolder, key)):
+                if messages:
+                    messages(f"Caching soil survey area {key}...")
+                cacheSurveyArea(cacheFolder, soilLayer, key, areasymbol, spatialver)
+                manifest[key] = {'source': source, 'source_path': sourcePaths[source], 'areasymbol': str(areasymbol),
+                                 'spatialver': spatialVersionText(spatialver), 'bytes': entryBytes(cacheFolder, key)}
+            elif messages:
+                messages(f"Using cached soil survey area {key}...")
+            manifest[key]['last_used'] = time()
+            if key not in current:
+                current.append(key)
+
+    # Older spatial versions of the survey areas in use from the same source are stale, as are entries cached before
+    # keys carried their source; drop them ahead of the LRU budget
+    inUse = {(manifest[key]['areasymbol'], manifest[key]['source']) for key in current}
+    inUseAreas = {areasymbol for areasymbol, source in inUse}
+    for key in [key for key in manifest if key not in current]:
+        entry = manifest[key]
+        legacy = 'source' not in entry and entry['areasymbol'] in inUseAreas
+        if legacy or (entry['areasymbol'], entry.get('source')) in inUse:
+            deleteEntry(cacheFolder, key)
+            del manifest[key]
+
+    evictEntries(cacheFolder, manifest, budgetMB * 1024 * 1024, current)
+    saveManifest(cacheFolder, manifest)
+    return [surveyAreaPath(cacheFolder, key) for key in current]
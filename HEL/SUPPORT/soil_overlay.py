@@ -0,0 +1,149 @@
+from os import path
+
+from arcpy import Describe, ListFields, Polygon
+from arcpy.da import InsertCursor, SearchCursor
+from arcpy.management import AddFields, CreateFeatureclass
+
+from erosion_index import HEL_CODES
+from hel_rules import rateCLUs
+from hel_summary import pivotAcresByCLU, roundPivot
+from hel_utils import describeDataset, invalidateDataset
+from spatial_index import dataSignature, oidWhereClause, querySoilOIDs
+
+
+# Soil polygons read by the overlay pre-check, kept for the life of the process so tracts of a batch that share soil
+# polygons read them once. Entries are dropped when the soil data signature changes or different fields are read:
+# {(soil catalog path, spatial reference name): (data signature, fields, {OID: (field values, geometry)})}
+soilGeometryCache = dict()
+
+# OIDs per where clause when reading soil polygons that are not cached yet
+OID_BATCH_SIZE = 1000
+
+# AddFields type keywords by ListFields field type
+ADD_FIELD_TYPES = {'String': 'TEXT', 'Double': 'DOUBLE', 'Single': 'FLOAT', 'Integer': 'LONG', 'SmallInteger': 'SHORT',
+                   'BigInteger': 'BIGINTEGER', 'Date': 'DATE', 'DateOnly': 'DATEONLY', 'TimeOnly': 'TIMEONLY',
+                   'TimestampOffset': 'TIMESTAMPOFFSET', 'Guid': 'GUID'}
+
+
+def attributeFields(dataset):
+    ''' Editable attribute fields of a dataset that Intersect carries to its output.'''
+    return [field for field in ListFields(dataset) if field.editable and field.type in ADD_FIELD_TYPES]
+
+
+def readSoilPolygons(soilPath, fields, oids, spatialReference):
+    ''' Return {OID: (field values, geometry)} for the soil polygon OIDs, projected to spatialReference. Polygons already
+        in soilGeometryCache are not read again unless the soil data was modified since.'''
+    signature = dataSignature(soilPath)
+    key = (soilPath, spatialReference.name)
+    cached = soilGeometryCache.get(key)
+    if not cached or cached[0] != signature or cached[1] != fields:
+        cached = soilGeometryCache[key] = (signature, fields, dict())
+    cache = cached[2]
+
+    missing = [oid for oid in oids if oid not in cache]
+    oidField = describeDataset(soilPath).oidFieldName
+    for start in range(0, len(missing), OID_BATCH_SIZE):
+        whereClause = oidWhereClause(oidField, missing[start:start+OID_BATCH_SIZE])
+        with SearchCursor(soilPath, ['OID@', 'SHAPE@'] + fields, whereClause, spatialReference) as cursor:
+            for row in cursor:
+                cache[row[0]] = (row[2:], row[1])
+    return {oid: cache[oid] for oid in oids if oid in cache}
+
+
+def overlaySoils(cluLayer, soilPath, fields, cluNumberField='clu_number'):
+    ''' Overlay the CLU fields with the soil polygons in memory. Returns (CLU number, soil field values, geometry,
+        acres) for every CLU x soil polygon intersection, or None when the soil data cannot be indexed.'''
+    cluSR = Describe(cluLayer).spatialReference
+    # Candidate soil polygons come from the persistent soil index; the exact test is done on their geometry below
+    soilOIDs = querySoilOIDs(soilPath, cluLayer)
+    if soilOIDs is None:
+        return None
+    soils = list(readSoilPolygons(soilPath, fields, soilOIDs, cluSR).values())
+    pieces = list()
+    with SearchCursor(cluLayer, [cluNumberField, 'SHAPE@']) as cursor:
+        for clu, cluShape in cursor:
+            cluExtent = cluShape.extent
+            for values, soilShape in soils:
+                soilExtent = soilShape.extent
+                if (soilExtent.XMin > cluExtent.XMax or soilExtent.XMax < cluExtent.XMin or
+                        soilExtent.YMin > cluExtent.YMax or soilExtent.YMax < cluExtent.YMin):
+                    continue
+                if cluShape.disjoint(soilShape):
+                    continue
+                pieceShape = cluShape.intersect(soilShape, 4)
+                pieceAcres = pieceShape.getArea('PLANAR', 'ACRES')
+                if pieceAcres > 0:
+                    pieces.append((clu, values, pieceShape, pieceAcres))
+    return pieces
+
+
+def pieceAcres(pieces, helIndex):
+    ''' CLU numbers, HEL values (field helIndex of the soil values) and acres of the overlay pieces: the acres both the
+        pre-check and, when the overlay is written out, the HEL summary rate the CLUs from.'''
+    return [piece[0] for piece in pieces], [piece[1][helIndex] for piece in pieces], [piece[3] for piece in pieces]
+
+
+def needsLiDARAnalysis(pieces, helIndex):
+    ''' Rate each CLU from the overlay pieces of its original soil HEL values (field helIndex of the soil values) before
+        any datasets are created. LiDAR analysis is needed only when PHEL soils are present and a CLU is neither
+        HEL >= 33.33% (or >= 50 acres) nor NHEL > 66.67%. Returns True, False, or None when there is no overlay, no CLU
+        overlaps the soils or a HEL value is missing or invalid; the full vector pipeline handles those.'''
+    if not pieces:
+        return None
+    cluNumbers, helValues, acres = pieceAcres(pieces, helIndex)
+    if any(value not in HEL_CODES for value in helValues):
+        return None
+    if 'PHEL' not in helValues:
+        return False
+    clus, pivotFields, pivotAcres = pivotAcresByCLU(cluNumbers, helValues, acres)
+    cluAcres, roundedAcres, pcts = roundPivot(pivotAcres)
+    ratings, columns, bHELgreaterthan33, bNHELgreaterthan66 = rateCLUs(pivotFields, roundedAcres, pcts)
+    return not bool((bHELgreaterthan33 | bNHELgreaterthan66).all())
+
+
+def _fieldSpecs(fields):
+    ''' AddFields definitions [name, type, alias, length] for ListFields fields.'''
+    return [[field.name, ADD_FIELD_TYPES[field.type], field.aliasName, field.length if field.type == 'String' else None]
+            for field in fields]
+
+
+def writeOverlay(pieces, soilFields, fieldDetermination, finalHELSummary, helSummary, dissolveFields,
+                 cluNumberField='clu_number'):
+    ''' Write the overlay pieces in place of Intersect, MultipartToSinglepart and Dissolve against the soil layer:
+        finalHELSummary gets one single part polygon per piece with the CLU and soil fields, and helSummary one
+        polygon per unique combination of dissolveFields.'''
+    sr = describeDataset(fieldDetermination).spatialReference
+    cluFields = attributeFields(fieldDetermination)
+    cluNames = [field.name for field in cluFields]
+    # Soil fields named like a CLU field are left out; soilIndexes locates the rest in the piece values
+    soilIndexes = [i for i, field in enumerate(soilFields) if field.name.lower() not in [name.lower() for name in cluNames]]
+    soilFields = [soilFields[i] for i in soilIndexes]
+    soilNames = [field.name for field in soilFields]
+    with SearchCursor(fieldDetermination, cluNames) as cursor:
+        cluRows = {row[cluNames.index(cluNumberField)]: row for row in cursor}
+
+    # Final HEL Summary: the CLU fields of the Field Determination followed by the soil fields, exploded to single parts
+    CreateFeatureclass(path.dirname(finalHELSummary), path.basename(finalHELSummary), 'POLYGON', fieldDetermination,
+                       spatial_reference=sr)
+    if soilFields:
+        AddFields(finalHELSummary, _fieldSpecs(soilFields))
+    invalidateDataset(finalHELSummary)
+
+    dissolveRows = dict()
+    with InsertCursor(finalHELSummary, ['SHAPE@'] + cluNames + soilNames) as cursor:
+        for clu, values, shape, acres in pieces:
+            row = list(cluRows[clu]) + [values[i] for i in soilIndexes]
+            for i in range(shape.partCount):
+                cursor.insertRow([Polygon(shape.getPart(i), sr)] + row)
+            rowValues = dict(zip(cluNames + soilNames, row))
+            key = tuple(rowValues[name] for name in dissolveFields)
+            dissolveRows[key] = dissolveRows[key].union(shape) if key in dissolveRows else shape
+
+    # Initial HEL Summary: dissolveFields only, as Dissolve leaves them
+    fieldsByName = {field.name: field for field in cluFields + soilFields}
+    CreateFeatureclass(path.dirname(helSummary), path.basename(helSummary), 'POLYGON', spatial_reference=sr)
+    AddFields(helSummary, _fieldSpecs([fieldsByName[name] for name in dissolveFields]))
+    invalidateDataset(helSummary)
+    with InsertCursor(helSummary, ['SHAPE@'] + dissolveFields) as cursor:
+        for key, shape in dissolveRows.items():
+            cursor.insertRow([shape] + list(key))
@@ -0,0 +1,210 @@
+from collections import namedtuple
+from math import ceil, sqrt
+from os import getpid, path, remove, replace, scandir
+
+from numpy import arange, argsort, asarray, concatenate, empty, float64, int64, lexsort, load, maximum, minimum, savez, \
+    unique
+
+from arcpy import Describe
+from arcpy.da import SearchCursor
+from arcpy.management import GetCount
+
+
+# Entries per R-tree node
+NODE_CAPACITY = 16
+
+# File name suffix of a persisted soil index, stored beside the soil data
+INDEX_SUFFIX = '.strtree.npz'
+
+# Sort-Tile-Recursive packed R-tree. itemBounds (xmin, ymin, xmax, ymax) and itemIds are in leaf order; levels[0]
+# holds the bounds of the leaf nodes and each following level the bounds of the level below grouped by nodeCapacity,
+# so the children of node i are entries i*nodeCapacity up to (i+1)*nodeCapacity of the level below.
+STRTree = namedtuple('STRTree', ['itemBounds', 'itemIds', 'levels', 'nodeCapacity'])
+
+# Soil indexes loaded or built in this process: {soil catalog path: (data signature, STRTree)}
+soilIndexCache = dict()
+
+
+def _groupBounds(bounds, nodeCapacity):
+    ''' Bounds of each consecutive group of nodeCapacity entries.'''
+    starts = arange(0, bounds.shape[0], nodeCapacity)
+    grouped = empty((starts.size, 4), dtype=float64)
+    grouped[:, 0] = minimum.reduceat(bounds[:, 0], starts)
+    grouped[:, 1] = minimum.reduceat(bounds[:, 1], starts)
+    grouped[:, 2] = maximum.reduceat(bounds[:, 2], starts)
+    grouped[:, 3] = maximum.reduceat(bounds[:, 3], starts)
+    return grouped
+
+
+def _strOrder(bounds, nodeCapacity):
+    ''' Sort-Tile-Recursive order of bounding boxes: sorted into vertical slices by x center, then by y center within
+        each slice, so every run of nodeCapacity entries is a compact tile.'''
+    n = bounds.shape[0]
+    sliceSize = ceil(sqrt(ceil(n / nodeCapacity))) * nodeCapacity
+    xCenter = bounds[:, 0] + bounds[:, 2]
+    yCenter = bounds[:, 1] + bounds[:, 3]
+    slices = empty(n, dtype=int64)
+    slices[argsort(xCenter, kind='stable')] = arange(n) // sliceSize
+    return lexsort((yCenter, slices))
+
+
+def buildSTRTree(bounds, itemIds, nodeCapacity=NODE_CAPACITY):
+    ''' Pack an R-tree over (xmin, ymin, xmax, ymax) bounding boxes of the items. Leaves are STR packed; upper levels
+        group consecutive nodes, which STR ordering keeps spatially compact.'''
+    bounds = asarray(bounds, dtype=float64).reshape(-1, 4)
+    itemIds = asarray(itemIds, dtype=int64)
+    order = _strOrder(bounds, nodeCapacity) if bounds.shape[0] else arange(0)
+    itemBounds = bounds[order]
+    levels = list()
+    level = itemBounds
+    while level.shape[0] > 1 or not levels and level.shape[0]:
+        level = _groupBounds(level, nodeCapacity)
+        levels.append(level)
+    return STRTree(itemBounds, itemIds[order], levels, nodeCapacity)
+
+
+def _intersects(bounds, xmin, ymin, xmax, ymax):
+    ''' Mask of the bounding boxes that intersect the query box.'''
+    return (bounds[:, 0] <= xmax) & (bounds[:, 2] >= xmin) & (bounds[:, 1] <= ymax) & (bounds[:, 3] >= ymin)
+
+
+def queryTree(tree, xmin, ymin, xmax, ymax):
+    ''' Return the ids of items whose bounding box intersects the query box.'''
+    if not tree.levels:
+        return tree.itemIds[:0]
+    children = arange(tree.nodeCapacity)
+    nodes = arange(tree.levels[-1].shape[0])
+    for i in range(len(tree.levels) - 1, -1, -1):
+        nodes = nodes[_intersects(tree.levels[i][nodes], xmin, ymin, xmax, ymax)]
+        below = tree.levels[i-1].shape[0] if i else tree.itemBounds.shape[0]
+        nodes = (nodes[:, None] * tree.nodeCapacity + children).reshape(-1)
+        nodes = nodes[nodes < below]
+    return tree.itemIds[nodes[_intersects(tree.itemBounds[nodes], xmin, ymin, xmax, ymax)]]
+
+
+def saveTree(tree, indexPath, signature):
+    ''' Save a tree and the dataSignature of the data it indexes to an .npz file. The file is written under a name of
+        this process and then moved into place, so concurrent workers and interrupted saves never leave a partial index.'''
+    levels = {f"level_{str(i)}": level for i, level in enumerate(tree.levels)}
+    tempPath = f"{indexPath}.{str(getpid())}.tmp"
+    try:
+        with open(tempPath, 'wb') as f:
+            savez(f, itemBounds=tree.itemBounds, itemIds=tree.itemIds, nodeCapacity=tree.nodeCapacity,
+                  signature=asarray(signature, dtype=float64), **levels)
+        replace(tempPath, indexPath)
+    except:
+        if path.exists(tempPath):
+            remove(tempPath)
+        raise
+
+
+def loadTree(indexPath):
+    ''' Load a tree saved by saveTree. Returns (signature of the indexed data, STRTree).'''
+    with load(indexPath, allow_pickle=False) as data:
+        levels = [data[f"level_{str(i)}"] for i in range(len([key for key in data.files if key.startswith('level_')]))]
+        signature = tuple(float(value) for value in data['signature'])
+        return signature, STRTree(data['itemBounds'], data['itemIds'], levels, int(data['nodeCapacity']))
+
+
+def _workspaceFolder(catalogPath):
+    ''' The geodatabase folder holding a dataset, or None for file based data such as shapefiles.'''
+    folder = path.dirname(catalogPath)
+    while folder and not folder.lower().endswith('.gdb') and folder != path.dirname(folder):
+        folder = path.dirname(folder)
+    return folder if folder.lower().endswith('.gdb') else None
+
+
+def soilIndexPath(catalogPath):
+    ''' Path of the persisted index of a soil dataset: beside the geodatabase, or beside the file itself.'''
+    gdb = _workspaceFolder(catalogPath)
+    if gdb:
+        return path.join(path.dirname(gdb), f"{path.basename(gdb)}.{path.basename(catalogPath)}{INDEX_SUFFIX}")
+    return f"{catalogPath}{INDEX_SUFFIX}"
+
+
+def dataModifiedTime(catalogPath):
+    ''' Latest modification time of the files backing a dataset: any file of its file geodatabase other than lock
+        files, or the files sharing its base name otherwise. Returns None for data that is not file based, such as
+        enterprise geodatabases and feature services.'''
+    try:
+        gdb = _workspaceFolder(catalogPath)
+        if gdb:
+            return max(entry.stat().st_mtime for entry in scandir(gdb) if entry.is_file() and not entry.name.lower().endswith('.lock'))
+        base = path.splitext(catalogPath)[0]
+        folder = path.dirname(catalogPath) or '.'
+        return max(entry.stat().st_mtime for entry in scandir(folder) if path.splitext(entry.path)[0] == base)
+    except (OSError, ValueError):
+        return None
+
+
+def dataSignature(catalogPath):
+    ''' Staleness key of a dataset: the modified time of its files with the row count and extent arcpy reports. An index
+        or cache built from the data is only reused while the key is unchanged; any difference, including an older
+        modified time from a copied or restored dataset, counts as a change. Returns None for data that is not file
+        based.'''
+    modified = dataModifiedTime(catalogPath)
+    if modified is None:
+        return None
+    extent = Describe(catalogPath).extent
+    return (modified, float(GetCount(catalogPath)[0]), extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+
+
+def getSoilIndex(soilPath):
+    ''' Return the STRTree of soil polygon bounding boxes by OID for a soil dataset. The index is loaded from beside
+        the soil data when it was built from data with the same signature; otherwise it is rebuilt and saved there when
+        writable. Returns None when the soil data is not file based and cannot be indexed.'''
+    catalogPath = Describe(soilPath).catalogPath
+    signature = dataSignature(catalogPath)
+    if signature is None:
+        return None
+    cached = soilIndexCache.get(catalogPath)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    indexPath = soilIndexPath(catalogPath)
+    tree = None
+    if path.exists(indexPath):
+        # Any index that cannot be read (truncated, empty or otherwise corrupt) is rebuilt and overwritten
+        try:
+            indexSignature, tree = loadTree(indexPath)
+            if indexSignature != signature:
+                tree = None
+        except Exception:
+            tree = None
+
+    if tree is None:
+        oids, bounds = list(), list()
+        with SearchCursor(catalogPath, ['OID@', 'SHAPE@']) as cursor:
+            for oid, shape in cursor:
+                if shape:
+                    extent = shape.extent
+                    oids.append(oid)
+                    bounds.append((extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+        tree = buildSTRTree(bounds, oids)
+        try:
+            saveTree(tree, indexPath, signature)
+        except OSError:
+            pass
+
+    soilIndexCache[catalogPath] = (signature, tree)
+    return tree
+
+
+def querySoilOIDs(soilPath, cluLayer):
+    ''' Return the sorted OIDs of soil polygons whose bounding box intersects the bounding box of a CLU field, or
+        None when the soil data cannot be indexed.'''
+    tree = getSoilIndex(soilPath)
+    if tree is None:
+        return None
+    soilSR = Describe(soilPath).spatialReference
+    oids = [tree.itemIds[:0]]
+    with SearchCursor(cluLayer, ['SHAPE@'], spatial_reference=soilSR) as cursor:
+        for row in cursor:
+            extent = row[0].extent
+            oids.append(queryTree(tree, extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+    return unique(concatenate(oids)).tolist()
+
+
+def oidWhereClause(oidField, oids):
+    ''' Where clause selecting a list of OIDs.'''
+    return f"{oidField} IN ({','.join(str(oid) for oid in oids)})" if oids else f"{oidField} IS NULL"
@@ -0,0 +1,33 @@
+from numpy import asarray, bincount, float64, int64, isnan, logical_and, logical_not, zeros
+
+
+def zonalHistogram(zones, classes, nClasses, histogram=None):
+    ''' Count the cells of each class (0 to nClasses - 1) in each integer zone with a single bincount over
+        (zone, class) pairs. NaN or negative zones are skipped. Pass the histogram returned by a previous call to
+        accumulate tiles. Returns an int64 array indexed by [zone, class].'''
+    zones = asarray(zones, dtype=float64)
+    inZone = logical_and(logical_not(isnan(zones)), zones >= 0)
+    zoneIds = zones[inZone].astype(int64)
+    pairs = zoneIds * nClasses + asarray(classes)[inZone].astype(int64)
+
+    size = int(zoneIds.max()) + 1 if zoneIds.size else 0
+    if histogram is not None:
+        size = max(size, histogram.shape[0])
+    counts = bincount(pairs, minlength=size * nClasses).reshape(size, nClasses)
+    if histogram is not None:
+        counts[:histogram.shape[0]] += histogram
+    return counts
+
+
+def emptyHistogram(nClasses):
+    ''' An empty zonal histogram to accumulate into.'''
+    return zeros((0, nClasses), dtype=int64)
+
+
+def zoneClassCounts(histogram, zones, classValue):
+    ''' Cell counts of one class for each zone ID in zones. Zones that received no cells get 0.'''
+    zones = asarray(zones, dtype=int64)
+    counts = zeros(zones.shape, dtype=int64)
+    inHistogram = logical_and(zones >= 0, zones < histogram.shape[0])
+    counts[inHistogram] = histogram[zones[inHistogram], classValue]
+    return counts